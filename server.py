@@ -1,41 +1,2281 @@
-from flask import Flask, render_template, request, redirect, url_for, session, Response
+from flask import Flask, Blueprint, current_app, render_template, stream_template, request, redirect, url_for, session, Response, get_template_attribute, abort, jsonify, g
+import io
 import os
+import json
+import sys
+import hmac
+import math
+import time
+import random
 import sqlite3
+import queue
+import bisect
+import pstats
+import cProfile
+import atexit
+import hashlib
+import re
+import unicodedata
+import threading
+import tracemalloc
+import shutil
+import tempfile
+import logging
+import statistics
+import http.client
+from functools import wraps
+from collections import namedtuple
 from datetime import datetime, timedelta
+from werkzeug.serving import make_server
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, the scheduler then runs in every worker
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:  # Optional, the order statistics are then counted with SQL
+    numpy = None
+
+# All the routes of the application, registered on the app by create_app()
+bp = Blueprint('kos', __name__)
+
+# Default settings of the application, create_app() can override any of them
+DEFAULT_CONFIG = {
+    # Secret key of the session cookies, a random one is generated when it isn't set
+    'SECRET_KEY': os.environ.get('KOS_SECRET_KEY'),
+
+    # Database setup
+    'DB_PATH': os.environ.get('KOS_DB_PATH', 'kebab_orders.db'),
+
+    # Journal mode of the SQLite database. In 'wal' mode the readers and the writer don't
+    # block each other and the journal is checkpointed by a maintenance job, 'delete' keeps
+    # the rollback journal for file systems without shared memory, like network shares
+    'JOURNAL_MODE': os.environ.get('KOS_JOURNAL_MODE', 'wal'),
+
+    # Storage engine used for the orders, 'sqlite', 'memory' or 'event'
+    'STORAGE': os.environ.get('KOS_STORAGE', 'sqlite'),
+
+    # Event mode settings, the orders are kept in memory and every change is appended to
+    # a log fsynced in batches, losing at most EVENT_MAX_LOSS seconds of changes in a crash
+    # (0 to wait for the fsync). The log is applied to the database every
+    # EVENT_SNAPSHOT_INTERVAL seconds. Needs a single worker.
+    'EVENT_LOG_PATH': os.environ.get('KOS_EVENT_LOG_PATH', ''),  # Default: DB_PATH + '-log.jsonl'
+    'EVENT_MAX_LOSS': float(os.environ.get('KOS_EVENT_MAX_LOSS', '0.05')),
+    'EVENT_SNAPSHOT_INTERVAL': float(os.environ.get('KOS_EVENT_SNAPSHOT_INTERVAL', '30')),
+
+    # Write-behind settings, writes of the SQLite storage go through one background
+    # thread committing them in groups of at most GROUP_COMMIT_MAX_BATCH statements,
+    # waiting at most GROUP_COMMIT_MAX_DELAY seconds for more writes to join a group
+    'WRITE_BEHIND': os.environ.get('KOS_WRITE_BEHIND', '0') == '1',
+    'GROUP_COMMIT_MAX_BATCH': int(os.environ.get('KOS_GROUP_COMMIT_MAX_BATCH', '64')),
+    'GROUP_COMMIT_MAX_DELAY': float(os.environ.get('KOS_GROUP_COMMIT_MAX_DELAY', '0.005')),
+
+    # Read replica settings, reads of the SQLite storage are served from an in-memory
+    # copy of the database that lags behind the writes of other workers by at most
+    # REPLICA_MAX_LAG seconds. Every refresh copies the whole database file, and a write
+    # of this worker forces one before its next read, so only enable it for workloads
+    # with many more reads than writes
+    'READ_REPLICA': os.environ.get('KOS_READ_REPLICA', '0') == '1',
+    'REPLICA_MAX_LAG': float(os.environ.get('KOS_REPLICA_MAX_LAG', '0.5')),
+
+    # Admission control settings for the write endpoints
+    'WRITE_RATE': float(os.environ.get('KOS_WRITE_RATE', '1')),  # Requests per second allowed per client, 0 for no limit
+    'WRITE_BURST': float(os.environ.get('KOS_WRITE_BURST', '10')),  # Requests a client can make in a burst
+    'MAX_CONCURRENT_WRITES': int(os.environ.get('KOS_MAX_CONCURRENT_WRITES', '4')),
+    'WRITE_ADMISSION_TIMEOUT': float(os.environ.get('KOS_WRITE_ADMISSION_TIMEOUT', '0.25')),  # Seconds
+
+    # Token required by the admin endpoints, they are disabled when it isn't set
+    'ADMIN_TOKEN': os.environ.get('KOS_ADMIN_TOKEN'),
+
+    # Fraction of the requests profiled with cProfile, 0 disables the profiling hooks
+    'PROFILE_SAMPLE_RATE': float(os.environ.get('KOS_PROFILE_SAMPLE_RATE', '0')),
+
+    # Hours the order events are kept before compaction removes them
+    'EVENT_RETENTION_HOURS': float(os.environ.get('KOS_EVENT_RETENTION_HOURS', '24')),
+
+    # Statements of the SQLite storage slower than this many seconds are logged with their query plan
+    'SLOW_QUERY_SECONDS': float(os.environ.get('KOS_SLOW_QUERY_SECONDS', '0.05')),
+
+    # Online backups of the SQLite database, into rotated snapshots checked for integrity
+    'BACKUP_DIR': os.environ.get('KOS_BACKUP_DIR', 'backups'),
+    'BACKUP_KEEP': int(os.environ.get('KOS_BACKUP_KEEP', '7')),  # Number of snapshots kept
+    'BACKUP_PAGES_PER_STEP': int(os.environ.get('KOS_BACKUP_PAGES_PER_STEP', '64')),
+    'BACKUP_STEP_SLEEP': float(os.environ.get('KOS_BACKUP_STEP_SLEEP', '0.005')),  # Seconds
+    'BACKUP_CRON': os.environ.get('KOS_BACKUP_CRON', ''),  # Schedule of the automatic backups, empty for none
+
+    # Columnar exports of the order history for the statistics, needs NumPy, 0 disables the exports
+    'HISTORY_DIR': os.environ.get('KOS_HISTORY_DIR', 'history'),
+    'HISTORY_EXPORT_INTERVAL': float(os.environ.get('KOS_HISTORY_EXPORT_INTERVAL', '3600')),  # Seconds
+
+    # Stream the index page, sending the head and form before the orders are read
+    'STREAM_INDEX': os.environ.get('KOS_STREAM_INDEX', '0') == '1',
+
+    # Warm the storage, templates and caches in the background when the app is created,
+    # /readyz only reports ready once it is done. A failed warm-up is tried again after
+    # WARM_UP_RETRY_DELAY seconds, doubled after every failure up to WARM_UP_MAX_RETRY_DELAY
+    'WARM_UP': os.environ.get('KOS_WARM_UP', '1') == '1',
+    'WARM_UP_RETRY_DELAY': float(os.environ.get('KOS_WARM_UP_RETRY_DELAY', '1')),
+    'WARM_UP_MAX_RETRY_DELAY': float(os.environ.get('KOS_WARM_UP_MAX_RETRY_DELAY', '60')),
+
+    # Background scheduler of the maintenance jobs, runs in one of the workers sharing the database
+    'SCHEDULER': os.environ.get('KOS_SCHEDULER', '1') == '1',
+    'EVENT_COMPACTION_CRON': os.environ.get('KOS_EVENT_COMPACTION_CRON', '30 3 * * *'),
+    'CHECKPOINT_INTERVAL': float(os.environ.get('KOS_CHECKPOINT_INTERVAL', '300')),  # Seconds
+
+    # Seconds a rendered summary is served from the cache before it is rendered again
+    'SUMMARY_CACHE_MAX_AGE': float(os.environ.get('KOS_SUMMARY_CACHE_MAX_AGE', '30')),
+
+    # Seconds the recent orders are served from the cache of a worker while no worker changed them
+    'RECENT_ORDERS_CACHE_MAX_AGE': float(os.environ.get('KOS_RECENT_ORDERS_CACHE_MAX_AGE', '10')),
+
+    # Long-polling settings, a waiting request returns after at most LONG_POLL_MAX_TIMEOUT
+    # seconds, and the writes of other workers are noticed within LONG_POLL_CHECK_INTERVAL
+    'LONG_POLL_MAX_TIMEOUT': float(os.environ.get('KOS_LONG_POLL_MAX_TIMEOUT', '30')),
+    'LONG_POLL_CHECK_INTERVAL': float(os.environ.get('KOS_LONG_POLL_CHECK_INTERVAL', '1')),
+}
+
+# Format of the order timestamps, they sort in chronological order as strings
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def encode_ingredients(ingredients):
+    """Encode a list of ingredients into the comma separated format of the database"""
+    return ','.join(ingredients) if ingredients else ''
+
+
+class Order(namedtuple('Order', ['id', 'name', 'kebab_type', 'meat', 'sauces', 'is_nature',
+                                 'vegetables', 'timestamp', 'client_id', 'version'])):
+    """An order, as returned by the order repositories
+
+    Orders are immutable tuples so the repositories and caches can share them.
+    The sauces and vegetables are interned tuples shared by all the orders with
+    the same ingredients. The version of an order is incremented by every update,
+    it is None where the storage doesn't keep it, like in the archive.
+    """
+
+    __slots__ = ()
+
+    @property
+    def config(self):
+        """Get the (kebab type, meat, sauces, is nature, vegetables) configuration of the order"""
+        return self.kebab_type, self.meat, self.sauces, self.is_nature, self.vegetables
+
+
+# Interned ingredient tuples, by tuple and by their encoding in the database
+ingredient_tuples = {}
+decoded_ingredients = {}
+MAX_INGREDIENT_TUPLES = 4096
+
+
+def intern_ingredients(ingredients):
+    """Get the shared tuple of a sequence of ingredients"""
+    ingredients = tuple(ingredients)
+    shared = ingredient_tuples.get(ingredients)
+    if shared is None:
+        # Old rows written before validation may hold arbitrary values, keep the table bounded
+        if len(ingredient_tuples) >= MAX_INGREDIENT_TUPLES:
+            ingredient_tuples.clear()
+        shared = ingredient_tuples[ingredients] = tuple(sys.intern(ingredient) for ingredient in ingredients)
+    return shared
 
-app = Flask(__name__)
-# set the port of the flask server
-app.secret_key = os.urandom(24)
-
-# Database setup
-DB_PATH = 'kebab_orders.db'
-
-
-def init_db():
-    """Initialize the database with the necessary table"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Create orders table if it doesn't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        kebab_type TEXT NOT NULL,
-        meat TEXT NOT NULL,
-        sauces TEXT,
-        is_nature INTEGER,
-        vegetables TEXT,
-        timestamp DATETIME NOT NULL
+
+def decode_ingredients(encoded):
+    """Get the shared tuple of ingredients of their comma separated encoding"""
+    shared = decoded_ingredients.get(encoded)
+    if shared is None:
+        if len(decoded_ingredients) >= MAX_INGREDIENT_TUPLES:
+            decoded_ingredients.clear()
+        shared = decoded_ingredients[encoded] = intern_ingredients(encoded.split(',') if encoded else ())
+    return shared
+
+
+def make_order(order_id, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id=None,
+               version=1):
+    """Create an order from its fields, sharing the interned strings and ingredient tuples"""
+    is_nature = bool(is_nature)
+    return Order(order_id, name, sys.intern(kebab_type), sys.intern(meat), intern_ingredients(sauces),
+                 is_nature, () if is_nature else intern_ingredients(vegetables), timestamp, client_id, version)
+
+
+def order_from_record(data):
+    """Convert the dictionary of an order, as returned by Order._asdict(), back into an order"""
+    return make_order(data['id'], data['name'], data['kebab_type'], data['meat'], data['sauces'], data['is_nature'],
+                      data['vegetables'], data['timestamp'], data['client_id'], data['version'])
+
+
+def decode_order(row):
+    """Convert a database row, or the JSON object of an order event, into an order"""
+    is_nature = bool(row['is_nature'])
+    columns = row.keys()
+    return Order(row['id'], row['name'], sys.intern(row['kebab_type']), sys.intern(row['meat']),
+                 decode_ingredients(row['sauces']), is_nature,
+                 () if is_nature else decode_ingredients(row['vegetables']), row['timestamp'],
+                 row['client_id'] if 'client_id' in columns else None,
+                 row['version'] if 'version' in columns else None)
+
+
+def event_row_to_event(row):
+    """Convert an order_events row into an event dictionary"""
+    return {
+        'seq': row['seq'],
+        'op': row['op'],
+        'order_id': row['order_id'],
+        'order': decode_order(json.loads(row['data'])) if row['data'] else None,
+        'timestamp': row['timestamp'],
+    }
+
+
+class PendingWrite:
+    """Write statements waiting in the queue of a GroupCommitWriter"""
+
+    __slots__ = ('statements', 'done', 'result', 'error')
+
+    def __init__(self, statements):
+        self.statements = statements
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def statement_fingerprint(sql):
+    """Normalize a statement so its variants with other literals or IN list lengths match"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', sql)
+    return ' '.join(sql.split())
+
+
+def params_shape(params):
+    """Describe the parameters of a statement by their types, without their values"""
+    shape = []
+    for param in params:
+        name = type(param).__name__
+        if shape and shape[-1][0] == name:
+            shape[-1][1] += 1
+        else:
+            shape.append([name, 1])
+    return ', '.join(name if count == 1 else f'{name} x {count}' for name, count in shape)
+
+
+def explain_query_plan(conn, sql, params):
+    """Get the EXPLAIN QUERY PLAN of a statement as indented lines"""
+    depths = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append('  ' * depths[node_id] + detail)
+    return lines
+
+
+def full_scans(plan):
+    """Get the steps of a query plan reading a whole table"""
+    scans = []
+    for line in plan:
+        step = line.strip()
+        match = re.match(r'SCAN (\w+)( VIRTUAL TABLE)?', step)
+        if match and not match.group(2) and step != 'SCAN CONSTANT ROW':
+            scans.append(step)
+    return scans
+
+
+def assert_uses_index(conn, sql, params=()):
+    """Check that a statement reads its tables through indexes, raise AssertionError otherwise
+
+    Meant for the checks of the hot queries, so a plan turning into a full scan fails them.
+    """
+    plan = explain_query_plan(conn, sql, params)
+    scans = full_scans(plan)
+    if scans:
+        raise AssertionError(f"Full scan in the plan of {statement_fingerprint(sql)}: " + '; '.join(scans))
+    return plan
+
+
+class SlowQueryLog:
+    """Statements of a SQLite database slower than `threshold` seconds, grouped by fingerprint
+
+    The first time a statement is slow, its EXPLAIN QUERY PLAN is captured with the
+    same parameters, so a query that started scanning a growing table shows up with
+    the plan explaining why. At most `max_entries` fingerprints are kept.
+    """
+
+    def __init__(self, db_path, threshold, max_entries=200):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dropped = 0
+
+    def record(self, sql, params, seconds):
+        """Record the duration of a statement if it is slow"""
+        if seconds < self.threshold:
+            return
+
+        fingerprint = statement_fingerprint(sql)
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            is_new = entry is None
+            if is_new:
+                if len(self.entries) >= self.max_entries:
+                    self.dropped += 1
+                    return
+                entry = self.entries[fingerprint] = {
+                    'fingerprint': fingerprint,
+                    'params': params_shape(params),
+                    'count': 0,
+                    'total_seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'last_seen': None,
+                    'plan': None,
+                    'full_scans': None,
+                }
+            entry['count'] += 1
+            entry['total_seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['last_seen'] = datetime.now().strftime(TIMESTAMP_FORMAT)
+
+        if is_new:
+            # Explaining doesn't run the statement, so this is safe for writes too
+            conn = sqlite3.connect(self.db_path)
+            try:
+                plan = explain_query_plan(conn, sql, params)
+                entry['full_scans'] = full_scans(plan)
+            except sqlite3.Error as e:
+                plan = [f"No plan: {e}"]
+            finally:
+                conn.close()
+            entry['plan'] = plan
+
+    def report(self):
+        """Get the slow statements, the most time spent first"""
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values()]
+        return sorted(entries, key=lambda entry: entry['total_seconds'], reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.entries = {}
+            self.dropped = 0
+
+    def get_metrics(self):
+        with self.lock:
+            return {'statements': len(self.entries), 'dropped': self.dropped, 'threshold_seconds': self.threshold}
+
+
+class GroupCommitWriter:
+    """Background thread executing write statements and committing them in groups
+
+    Callers queue their statements and wait until the group they went into is
+    committed, so a burst of orders pays for one commit instead of one per order. The
+    statements of each caller run in their own savepoint so a failing write doesn't
+    take the others with it.
+    """
+
+    def __init__(self, db_path, max_batch, max_delay, slow_queries=None):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.slow_queries = slow_queries
+        self.queue = queue.Queue()
+        self.metrics = {'writes': 0, 'commits': 0, 'largest_group': 0, 'commit_seconds': 0.0}
+        self.thread = threading.Thread(target=self.run, name='group-commit-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, statements):
+        """Queue (sql, params) statements and wait until they are committed
+
+        Returns the (lastrowid, rowcount) of each statement.
+        """
+        write = PendingWrite(statements)
+        self.queue.put(write)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def next_group(self):
+        """Wait for a write, then gather the writes arriving within the latency budget"""
+        group = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(group) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                group.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def run(self):
+        # Transactions are handled explicitly so the savepoints don't commit on release
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        while True:
+            group = self.next_group()
+            start = time.perf_counter()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for write in group:
+                    conn.execute('SAVEPOINT pending_write')
+                    try:
+                        write.result = []
+                        for sql, params in write.statements:
+                            statement_start = time.perf_counter()
+                            cursor = conn.execute(sql, params)
+                            if self.slow_queries is not None:
+                                self.slow_queries.record(sql, params, time.perf_counter() - statement_start)
+                            write.result.append((cursor.lastrowid, cursor.rowcount))
+                    except sqlite3.Error as e:
+                        conn.execute('ROLLBACK TO pending_write')
+                        write.error = e
+                    conn.execute('RELEASE pending_write')
+                conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for write in group:
+                    write.result = None
+                    write.error = write.error or e
+
+            self.metrics['writes'] += len(group)
+            self.metrics['commits'] += 1
+            self.metrics['largest_group'] = max(self.metrics['largest_group'], len(group))
+            self.metrics['commit_seconds'] += time.perf_counter() - start
+
+            # Wake up the callers once their writes are durable
+            for write in group:
+                write.done.set()
+
+
+class ReplicaCopy:
+    """One in-memory copy of a database, read through a pool of connections sharing its cache
+
+    The copy lives as long as one of its connections is open, the pooled connections
+    of a retired copy are closed as soon as their reads are done.
+    """
+
+    def __init__(self, uri, data_version):
+        self.uri = uri
+        self.data_version = data_version
+        self.changes = None
+        self.anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.idle = []
+        self.retired = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+
+class ReadReplica:
+    """In-memory copy of a SQLite database serving the reads of this worker
+
+    A connection kept open on the database file watches `PRAGMA data_version`, which
+    changes whenever another connection commits. A new copy is then made with the
+    backup API, at most once every `max_lag` seconds so a write storm doesn't turn into
+    a copy storm. Writes made through this worker mark the copy stale, the next read
+    waits for a new copy so this worker reads its own writes right away.
+
+    Each refresh copies the whole database file, the archive, the order events and the
+    search index included, so the replica only pays off when the reads far outnumber
+    the writes. The new copy is made while the reads go on with the current one, and
+    each read takes its own connection to the copy, so the reads only wait for each
+    other on the accesses to the shared pages of the copy.
+    """
+
+    def __init__(self, db_path, max_lag, slow_queries=None):
+        self.db_path = db_path
+        self.max_lag = max_lag
+        self.slow_queries = slow_queries
+
+        # Held for the state below and the source connection, never while copying or reading
+        self.lock = threading.Lock()
+
+        # Held by the thread making a new copy
+        self.refresh_lock = threading.Lock()
+
+        self.source = sqlite3.connect(db_path, check_same_thread=False)
+        self.current = None
+        self.copies = 0
+        self.refreshed_at = 0.0
+        self.stale_since = None
+        self.forced = False
+        self.metrics = {'refreshes': 0, 'refresh_seconds': 0.0, 'max_lag_seconds': 0.0, 'reads': 0}
+
+    def mark_stale(self):
+        """Force a refresh before the next read"""
+        with self.lock:
+            self.forced = True
+
+    def refresh_if_stale(self):
+        """Make a new copy if the database changed and the lag budget is spent, return the copy to read"""
+        with self.lock:
+            now = time.monotonic()
+            current = self.current
+            forced = self.forced
+            if current is not None and not forced:
+                if self.source.execute('PRAGMA data_version').fetchone()[0] == current.data_version:
+                    return current
+                if self.stale_since is None:
+                    self.stale_since = now
+                if now - self.refreshed_at < self.max_lag:
+                    return current
+
+        if not forced and current is not None:
+            # The copy being made by another thread is enough, read the current one meanwhile
+            if not self.refresh_lock.acquire(blocking=False):
+                return current
+        else:
+            self.refresh_lock.acquire()
+
+        try:
+            with self.lock:
+                # Another thread made a new copy while this one waited, which has the writes of this worker
+                if self.current is not current and not self.forced:
+                    return self.current
+                self.forced = False
+                data_version = self.source.execute('PRAGMA data_version').fetchone()[0]
+                self.copies += 1
+                uri = f'file:kos-replica-{id(self)}-{self.copies}?mode=memory&cache=shared'
+
+            start = time.monotonic()
+            copy = ReplicaCopy(uri, data_version)
+            source = sqlite3.connect(self.db_path)
+            try:
+                source.backup(copy.anchor)
+            finally:
+                source.close()
+            copy.changes = copy.anchor.execute("SELECT value FROM kos_meta WHERE key = 'changes'").fetchone()[0]
+
+            with self.lock:
+                old, self.current = self.current, copy
+                self.refreshed_at = time.monotonic()
+                self.metrics['refreshes'] += 1
+                self.metrics['refresh_seconds'] += self.refreshed_at - start
+                if self.stale_since is not None:
+                    self.metrics['max_lag_seconds'] = max(self.metrics['max_lag_seconds'],
+                                                          self.refreshed_at - self.stale_since)
+                self.stale_since = None
+                if old is not None:
+                    old.retired = True
+                    idle, old.idle = old.idle, []
+            if old is not None:
+                for conn in idle:
+                    conn.close()
+                old.anchor.close()
+            return copy
+        finally:
+            self.refresh_lock.release()
+
+    def query(self, sql, params):
+        """Execute a read query on the copy and return all its rows"""
+        while True:
+            copy = self.refresh_if_stale()
+            with self.lock:
+                # A retired copy may be gone already, opening a connection would create an empty database
+                if copy.retired:
+                    continue
+                conn = copy.idle.pop() if copy.idle else copy.connect()
+                self.metrics['reads'] += 1
+                break
+
+        try:
+            start = time.perf_counter()
+            rows = conn.execute(sql, params).fetchall()
+            if self.slow_queries is not None:
+                self.slow_queries.record(sql, params, time.perf_counter() - start)
+            return rows
+        finally:
+            with self.lock:
+                keep = not copy.retired
+                if keep:
+                    copy.idle.append(conn)
+            if not keep:
+                conn.close()
+
+    def get_metrics(self):
+        """Get the metrics of the replica, with its current lag"""
+        with self.lock:
+            lag = time.monotonic() - self.stale_since if self.stale_since is not None else 0.0
+            data_version = self.current.data_version if self.current is not None else None
+            return dict(self.metrics, lag_seconds=lag, data_version=data_version)
+
+
+class ChangeCounter:
+    """Change counter of a SQLite database, shared by all the workers using the file
+
+    Triggers increment the counter in the same transaction as each change of the
+    orders. A connection kept open on the file checks `PRAGMA data_version`, which
+    only changes when another connection committed, and the counter is only read
+    again when it did. Checking costs no read of the tables, and caches keyed by
+    the counter are dropped only when the orders actually changed.
+    """
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.data_version = None
+        self.value = None
+        self.metrics = {'checks': 0, 'reads': 0}
+
+    def get(self):
+        """Get the current value of the counter"""
+        with self.lock:
+            self.metrics['checks'] += 1
+            data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self.data_version:
+                # A commit between these two statements is seen again by the next check
+                self.value = self.conn.execute("SELECT value FROM kos_meta WHERE key = 'changes'").fetchone()[0]
+                self.data_version = data_version
+                self.metrics['reads'] += 1
+            return self.value
+
+    def get_metrics(self):
+        with self.lock:
+            return dict(self.metrics, value=self.value)
+
+
+class BackupRestarted(Exception):
+    """Raised to stop a page by page backup restarted too often by concurrent writes"""
+
+
+class OnlineBackup:
+    """Online backups of a SQLite database into rotated snapshot files
+
+    The backup API copies `pages_per_step` pages at a time and sleeps `step_sleep`
+    seconds in between, so a writer waits at most for one step instead of the whole
+    copy. A commit from another connection restarts the copy, after `max_restarts`
+    restarts the rest is copied in a single step so the backup always ends. Each
+    snapshot passes PRAGMA integrity_check before it is kept, with the `keep` newest.
+    """
+
+    def __init__(self, db_path, backup_dir, keep=7, pages_per_step=64, step_sleep=0.005, max_restarts=3):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.max_restarts = max_restarts
+        self.lock = threading.Lock()
+        self.metrics = {
+            'backups': 0,
+            'failures': 0,
+            'restarts': 0,
+            'total_seconds': 0.0,
+            'max_writer_stall_seconds': 0.0,
+            'last': None,
+        }
+
+    def snapshot_name(self):
+        """Get the base name and extension of the snapshot files"""
+        name, extension = os.path.splitext(os.path.basename(self.db_path))
+        return name + '-', extension or '.db'
+
+    def snapshots(self):
+        """Get the paths of the snapshots, oldest first"""
+        prefix, extension = self.snapshot_name()
+        if not os.path.isdir(self.backup_dir):
+            return []
+        return [os.path.join(self.backup_dir, name) for name in sorted(os.listdir(self.backup_dir))
+                if name.startswith(prefix) and name.endswith(extension)]
+
+    def run(self):
+        """Write a new snapshot and remove the old ones, return the report of the backup
+
+        Raises RuntimeError if a backup is already running, and sqlite3.DatabaseError
+        if the snapshot is corrupt.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A backup is already running")
+        try:
+            report = self.backup()
+        except Exception:
+            self.metrics['failures'] += 1
+            raise
+        finally:
+            self.lock.release()
+
+        self.metrics['backups'] += 1
+        self.metrics['restarts'] += report['restarts']
+        self.metrics['total_seconds'] += report['seconds']
+        self.metrics['max_writer_stall_seconds'] = max(self.metrics['max_writer_stall_seconds'],
+                                                       report['max_writer_stall_seconds'])
+        self.metrics['last'] = report
+        return report
+
+    def backup(self):
+        """Copy the database into a new snapshot file"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        prefix, extension = self.snapshot_name()
+        path = os.path.join(self.backup_dir, prefix + datetime.now().strftime('%Y%m%d-%H%M%S-%f') + extension)
+        temp_path = path + '.tmp'
+
+        # Progress of the copy, updated after each step
+        progress = {'steps': 0, 'pages': 0, 'remaining': None, 'restarts': 0,
+                    'stall': 0.0, 'max_stall': 0.0, 'step_start': 0.0}
+
+        def on_step(status, remaining, pages):
+            # The source is only locked during the step itself, not during this callback
+            step_seconds = time.perf_counter() - progress['step_start']
+            progress['steps'] += 1
+            progress['pages'] = pages
+            progress['stall'] += step_seconds
+            progress['max_stall'] = max(progress['max_stall'], step_seconds)
+
+            # The copy starts over when another connection changed the database
+            if progress['remaining'] is not None and remaining > progress['remaining']:
+                progress['restarts'] += 1
+                if progress['restarts'] > self.max_restarts:
+                    raise BackupRestarted()
+            progress['remaining'] = remaining
+
+            if remaining:
+                time.sleep(self.step_sleep)
+            progress['step_start'] = time.perf_counter()
+
+        start = time.perf_counter()
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(temp_path)
+        try:
+            progress['step_start'] = time.perf_counter()
+            try:
+                source.backup(target, pages=self.pages_per_step, progress=on_step, sleep=self.step_sleep)
+            except BackupRestarted:
+                # Too many writes to finish page by page, copy the rest while holding the lock
+                step_start = time.perf_counter()
+                source.backup(target, sleep=self.step_sleep)
+                step_seconds = time.perf_counter() - step_start
+                progress['stall'] += step_seconds
+                progress['max_stall'] = max(progress['max_stall'], step_seconds)
+            page_size = source.execute('PRAGMA page_size').fetchone()[0]
+            pages = target.execute('PRAGMA page_count').fetchone()[0]
+
+            # Check the snapshot before it replaces an older one
+            problems = [row[0] for row in target.execute('PRAGMA integrity_check')]
+        finally:
+            source.close()
+            target.close()
+
+        if problems != ['ok']:
+            os.remove(temp_path)
+            raise sqlite3.DatabaseError("The snapshot failed the integrity check: " + '; '.join(problems[:5]))
+        os.replace(temp_path, path)
+        seconds = time.perf_counter() - start
+
+        # Remove the oldest snapshots
+        removed = self.snapshots()[:-self.keep] if self.keep > 0 else []
+        for old_path in removed:
+            os.remove(old_path)
+
+        return {
+            'path': path,
+            'seconds': seconds,
+            'pages': pages,
+            'bytes': pages * page_size,
+            'bytes_per_second': pages * page_size / seconds if seconds else None,
+            'steps': progress['steps'],
+            'restarts': progress['restarts'],
+            # Time the source was locked by the copy, the longest step is the longest a writer could wait
+            'writer_stall_seconds': progress['stall'],
+            'max_writer_stall_seconds': progress['max_stall'],
+            'removed': removed,
+        }
+
+    def get_metrics(self):
+        """Get the metrics of the backups, with the report of the last one"""
+        return dict(self.metrics, snapshots=len(self.snapshots()))
+
+
+class OrderSelection(namedtuple('OrderSelection', 'ids since until name', defaults=(None, None, None, None))):
+    """Orders selected by a bulk operation, by ID list, time range and/or name
+
+    The criteria that are set must all match. Timestamps are inclusive bounds.
+    """
+
+    def is_empty(self):
+        """Check if no criteria is set, an empty selection is refused rather than matching everything"""
+        return self.ids is None and self.since is None and self.until is None and self.name is None
+
+    def to_sql(self):
+        """Get the WHERE clause and parameters matching the selection"""
+        clauses = []
+        params = []
+        if self.ids is not None:
+            clauses.append(f"id IN ({', '.join('?' * len(self.ids))})")
+            params.extend(self.ids)
+        if self.since is not None:
+            clauses.append('timestamp >= ?')
+            params.append(self.since)
+        if self.until is not None:
+            clauses.append('timestamp <= ?')
+            params.append(self.until)
+        if self.name is not None:
+            clauses.append('name = ?')
+            params.append(self.name)
+        return ' AND '.join(clauses), params
+
+    def matches(self, order):
+        """Check if an order is selected"""
+        return ((self.ids is None or order.id in self.ids)
+                and (self.since is None or order.timestamp >= self.since)
+                and (self.until is None or order.timestamp <= self.until)
+                and (self.name is None or order.name == self.name))
+
+
+class OrderRepository:
+    """Storage of the orders
+
+    Orders are returned as immutable Order tuples, shared with the caches, with the
+    sauces and vegetables as interned tuples and is_nature as a boolean. Configurations
+    returned by aggregate() are tuples of (kebab_type, meat, sauces, is_nature,
+    vegetables), the `config` of the orders.
+    """
+
+    def create(self, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id=None):
+        """Store a new order and return its ID
+
+        `client_id` is an optional unique ID generated by the client. If an order with
+        the same client ID exists, nothing is stored and the ID of that order is returned.
+        """
+        raise NotImplementedError
+
+    def create_many(self, orders):
+        """Store new orders in one transaction
+
+        `orders` are dictionaries with the arguments of create(). Returns the
+        (order ID, created) of each order, created is False for replayed client IDs.
+        """
+        raise NotImplementedError
+
+    def update(self, order_id, name, kebab_type, meat, sauces, is_nature, vegetables, version=None):
+        """Update an existing order and increment its version
+
+        If `version` is given, the order is only updated if it is still at that
+        version. Returns False if the order doesn't exist or was changed since.
+        """
+        raise NotImplementedError
+
+    def delete(self, order_id):
+        """Delete an order, return False if it doesn't exist"""
+        raise NotImplementedError
+
+    def get(self, order_id):
+        """Get a specific order by ID, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def list_window(self, since):
+        """Get the orders placed after the `since` timestamp, newest first"""
+        raise NotImplementedError
+
+    def aggregate(self, since):
+        """Count the identical configurations of the orders placed after `since`
+
+        Returns a list of (configuration, count) ordered by most recent order first.
+        """
+        raise NotImplementedError
+
+    def changes_since(self, after, limit):
+        """Get the order events with a sequence number above `after`, oldest first
+
+        Every create, update and delete appends an event with a monotonic sequence
+        number and the state of the order after the change (None for deletes).
+        Returns (events, latest sequence number, horizon), events up to the horizon
+        were removed by compaction.
+        """
+        raise NotImplementedError
+
+    def compact_events(self, before):
+        """Remove the order events older than the `before` timestamp, return how many were removed"""
+        raise NotImplementedError
+
+    def latest_seq(self):
+        """Get the sequence number of the latest order event, the version of the order data"""
+        raise NotImplementedError
+
+    def change_counter(self):
+        """Get a number increased by every change of the orders, made by this worker or another one
+
+        Cheap enough to be checked by every request using a cache of the orders.
+        """
+        raise NotImplementedError
+
+    def checkpoint(self):
+        """Flush the journal of the storage into its main file, if it has one"""
+
+    def warm_up(self):
+        """Load the stored data into the caches of the system, return the number of bytes read"""
+        return 0
+
+    def search(self, text, limit):
+        """Search the live and archived orders by name and contents, newest first
+
+        Every word of `text` must match the start of a word of the customer name,
+        kebab type, meat or ingredients of the order.
+        """
+        raise NotImplementedError
+
+    def last_orders(self, name, limit):
+        """Get the last live or archived orders of a customer, newest first"""
+        raise NotImplementedError
+
+    def reorder(self, order_id, timestamp):
+        """Copy a live or archived order as a new order placed at `timestamp`
+
+        Returns the ID of the new order, or None if the order doesn't exist.
+        """
+        raise NotImplementedError
+
+    def bulk_delete(self, selection):
+        """Delete the selected orders in one transaction, return how many were deleted"""
+        raise NotImplementedError
+
+    def bulk_archive(self, selection):
+        """Move the selected orders to the archive in one transaction, return how many were moved"""
+        raise NotImplementedError
+
+    def bulk_duplicate(self, selection, timestamp):
+        """Copy the selected orders, live or archived, as new orders placed at `timestamp`
+
+        Runs in one transaction and returns how many orders were created.
+        """
+        raise NotImplementedError
+
+    def get_metrics(self):
+        """Get the metrics of the storage engine"""
+        return {}
+
+
+class SQLiteOrderRepository(OrderRepository):
+    """Orders stored in a SQLite database file"""
+
+    # Columns added to the orders table after its creation, with their definition
+    ADDED_ORDER_COLUMNS = [
+        ('client_id', 'TEXT'),
+        ('version', 'INTEGER NOT NULL DEFAULT 1'),
+    ]
+
+    # JSON object of the new row, stored in the order events
+    ORDER_JSON = (
+        "json_object('id', NEW.id, 'name', NEW.name, 'kebab_type', NEW.kebab_type, 'meat', NEW.meat, "
+        "'sauces', NEW.sauces, 'is_nature', NEW.is_nature, 'vegetables', NEW.vegetables, "
+        "'timestamp', NEW.timestamp, 'client_id', NEW.client_id, 'version', NEW.version)"
     )
-    ''')
 
-    conn.commit()
-    conn.close()
+    # Searchable text of the new row besides the customer name
+    SEARCH_CONTENTS = "NEW.kebab_type || ' ' || NEW.meat || ' ' || IFNULL(NEW.sauces, '') || ' ' || IFNULL(NEW.vegetables, '')"
+
+    # Columns of the live and archived orders, as read by decode_order()
+    ORDER_COLUMNS = 'id, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp'
+
+    WINDOW_SQL = 'SELECT * FROM orders WHERE timestamp > ? ORDER BY timestamp DESC, id DESC'
+    AGGREGATE_SQL = '''
+    SELECT kebab_type, meat, sauces, is_nature, vegetables, COUNT(*) AS count
+    FROM orders WHERE timestamp > ?
+    GROUP BY kebab_type, meat, sauces, is_nature, vegetables
+    ORDER BY MAX(timestamp) DESC, MAX(id) DESC
+    '''
+    LAST_ORDERS_SQL = f'''
+    SELECT {ORDER_COLUMNS} FROM orders WHERE name = ?
+    UNION ALL
+    SELECT {ORDER_COLUMNS} FROM orders_archive WHERE name = ?
+    ORDER BY timestamp DESC, id DESC LIMIT ?
+    '''
+    CHANGES_SQL = 'SELECT * FROM order_events WHERE seq > ? ORDER BY seq LIMIT ?'
+
+    # Queries of every page view and poll, their plans must not read whole tables
+    HOT_QUERIES = [
+        (WINDOW_SQL, ('',)),
+        (AGGREGATE_SQL, ('',)),
+        ('SELECT * FROM orders WHERE id = ?', (0,)),
+        (LAST_ORDERS_SQL, ('', '', 5)),
+        (CHANGES_SQL, (0, 500)),
+    ]
+
+    # Journal modes accepted by init_db()
+    JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist')
+
+    def __init__(self, db_path, write_behind=False, group_commit_max_batch=64, group_commit_max_delay=0.005,
+                 read_replica=False, replica_max_lag=0.5, slow_query_seconds=0.05, journal_mode='wal'):
+        if journal_mode not in self.JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode: {journal_mode}")
+        self.db_path = db_path
+        self.journal_mode = journal_mode
+        self.has_search_index = True
+        self.init_db()
+        self.slow_queries = SlowQueryLog(db_path, slow_query_seconds)
+        self.changes = ChangeCounter(db_path)
+
+        # Optionally hand the writes over to a background thread committing them in groups
+        self.writer = None
+        if write_behind:
+            self.writer = GroupCommitWriter(db_path, group_commit_max_batch, group_commit_max_delay,
+                                            self.slow_queries)
+
+        # Optionally serve the reads from an in-memory copy of the database
+        self.replica = None
+        if read_replica:
+            self.replica = ReadReplica(db_path, replica_max_lag, self.slow_queries)
+
+    def connect(self):
+        """Open a connection to the database"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        return conn
+
+    def init_db(self):
+        """Initialize the database with the necessary tables"""
+        conn = self.connect()
+
+        # The journal mode is stored in the database file, this also switches existing databases
+        # as long as no other connection is open on them
+        if conn.execute('PRAGMA journal_mode').fetchone()[0] != self.journal_mode:
+            conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        conn.executescript('''
+        -- Create orders table if it doesn't exist
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            kebab_type TEXT NOT NULL,
+            meat TEXT NOT NULL,
+            sauces TEXT,
+            is_nature INTEGER,
+            vegetables TEXT,
+            timestamp DATETIME NOT NULL
+        );
+
+        -- Append-only log of the changes made to the orders, the triggers below write
+        -- it in the same transaction as the change itself
+        CREATE TABLE IF NOT EXISTS order_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            data TEXT,
+            timestamp DATETIME NOT NULL
+        );
+
+        -- Orders of the closed rounds, moved out of the orders table
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            kebab_type TEXT NOT NULL,
+            meat TEXT NOT NULL,
+            sauces TEXT,
+            is_nature INTEGER,
+            vegetables TEXT,
+            timestamp DATETIME NOT NULL,
+            archived_at DATETIME NOT NULL
+        );
+
+        -- Internal counters of the storage
+        CREATE TABLE IF NOT EXISTS kos_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO kos_meta (key, value) VALUES ('events_horizon', 0);
+        INSERT OR IGNORE INTO kos_meta (key, value) VALUES ('changes', 0);
+
+        ''')
+
+        # Add the columns created after the first version of the orders table
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(orders)')}
+        for column, definition in self.ADDED_ORDER_COLUMNS:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE orders ADD COLUMN {column} {definition}')
+        conn.commit()
 
+        conn.executescript('''
+        -- Client IDs of the orders, replayed submissions of the same order are ignored
+        CREATE UNIQUE INDEX IF NOT EXISTS orders_client_id ON orders (client_id) WHERE client_id IS NOT NULL;
+
+        -- Orders of the recent window
+        CREATE INDEX IF NOT EXISTS orders_timestamp ON orders (timestamp);
+
+        -- Last orders of each customer
+        CREATE INDEX IF NOT EXISTS orders_name_timestamp ON orders (name, timestamp);
+        CREATE INDEX IF NOT EXISTS orders_archive_name_timestamp ON orders_archive (name, timestamp);
+
+        CREATE TRIGGER IF NOT EXISTS order_deleted AFTER DELETE ON orders BEGIN
+            INSERT INTO order_events (order_id, op, data, timestamp)
+            VALUES (OLD.id, 'delete', NULL, strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'));
+        END;
+
+        -- Change counter checked by the caches of every worker, see ChangeCounter
+        CREATE TRIGGER IF NOT EXISTS orders_counted_created AFTER INSERT ON orders BEGIN
+            UPDATE kos_meta SET value = value + 1 WHERE key = 'changes';
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS orders_counted_updated AFTER UPDATE ON orders BEGIN
+            UPDATE kos_meta SET value = value + 1 WHERE key = 'changes';
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS orders_counted_deleted AFTER DELETE ON orders BEGIN
+            UPDATE kos_meta SET value = value + 1 WHERE key = 'changes';
+        END;
+        ''')
+        self.init_change_feed(conn)
+        self.init_search(conn)
+        conn.close()
+
+    def init_change_feed(self, conn):
+        """Create the triggers writing the new state of the orders into the order events
+
+        The triggers of databases created before ORDER_JSON last changed are replaced,
+        in one transaction so the writes of the other workers don't miss them.
+        """
+        existing = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'order_created'").fetchone()
+        if existing is not None and self.ORDER_JSON in existing[0]:
+            return
+
+        conn.executescript('''
+        BEGIN IMMEDIATE;
+        DROP TRIGGER IF EXISTS order_created;
+        DROP TRIGGER IF EXISTS order_updated;
+
+        CREATE TRIGGER order_created AFTER INSERT ON orders BEGIN
+            INSERT INTO order_events (order_id, op, data, timestamp)
+            VALUES (NEW.id, 'create', ''' + self.ORDER_JSON + ''', strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'));
+        END;
+
+        CREATE TRIGGER order_updated AFTER UPDATE ON orders BEGIN
+            INSERT INTO order_events (order_id, op, data, timestamp)
+            VALUES (NEW.id, 'update', ''' + self.ORDER_JSON + ''', strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'));
+        END;
+        COMMIT;
+        ''')
+
+    def init_search(self, conn):
+        """Create the full-text index of the live and archived orders, kept up to date by triggers"""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'order_search'").fetchone()
+        try:
+            conn.executescript('''
+            -- The rowid is the order ID, archived orders keep the ID they had in the orders table
+            CREATE VIRTUAL TABLE IF NOT EXISTS order_search USING fts5 (
+                name, contents, tokenize = 'unicode61 remove_diacritics 2'
+            );
+
+            CREATE TRIGGER IF NOT EXISTS order_search_created AFTER INSERT ON orders BEGIN
+                INSERT INTO order_search (rowid, name, contents) VALUES (NEW.id, NEW.name, ''' + self.SEARCH_CONTENTS + ''');
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS order_search_updated AFTER UPDATE ON orders BEGIN
+                DELETE FROM order_search WHERE rowid = OLD.id;
+                INSERT INTO order_search (rowid, name, contents) VALUES (NEW.id, NEW.name, ''' + self.SEARCH_CONTENTS + ''');
+            END;
+
+            -- Archiving copies the order before deleting it, the archived copy stays searchable
+            CREATE TRIGGER IF NOT EXISTS order_search_deleted AFTER DELETE ON orders
+            WHEN NOT EXISTS (SELECT 1 FROM orders_archive WHERE id = OLD.id) BEGIN
+                DELETE FROM order_search WHERE rowid = OLD.id;
+            END;
+
+            -- Orders archived after their deletion, as the event mode snapshots do
+            CREATE TRIGGER IF NOT EXISTS order_search_archived AFTER INSERT ON orders_archive
+            WHEN NOT EXISTS (SELECT 1 FROM orders WHERE id = NEW.id) BEGIN
+                INSERT INTO order_search (rowid, name, contents) VALUES (NEW.id, NEW.name, ''' + self.SEARCH_CONTENTS + ''');
+            END;
+            ''')
+        except sqlite3.OperationalError:
+            # SQLite was built without FTS5, search() falls back to scanning the names
+            self.has_search_index = False
+            return
+
+        if not exists:
+            # Index the orders stored before the index was created
+            conn.execute('''
+            INSERT INTO order_search (rowid, name, contents)
+            SELECT id, name, ''' + self.SEARCH_CONTENTS.replace('NEW.', '') + ''' FROM orders
+            UNION ALL
+            SELECT id, name, ''' + self.SEARCH_CONTENTS.replace('NEW.', '') + ''' FROM orders_archive
+            ''')
+            conn.commit()
+
+    def query(self, sql, params):
+        """Execute a read query and return all its rows"""
+        if self.replica is not None:
+            return self.replica.query(sql, params)
+
+        conn = self.connect()
+        try:
+            start = time.perf_counter()
+            rows = conn.execute(sql, params).fetchall()
+            self.slow_queries.record(sql, params, time.perf_counter() - start)
+            return rows
+        finally:
+            conn.close()
+
+    def write_all(self, *statements):
+        """Execute (sql, params) statements in one transaction
+
+        Returns the (lastrowid, rowcount) of each statement once committed.
+        """
+        if self.writer is not None:
+            results = self.writer.submit(statements)
+        else:
+            # Execute the statements in their own transaction
+            conn = self.connect()
+            try:
+                results = []
+                for sql, params in statements:
+                    start = time.perf_counter()
+                    cursor = conn.execute(sql, params)
+                    self.slow_queries.record(sql, params, time.perf_counter() - start)
+                    results.append((cursor.lastrowid, cursor.rowcount))
+                conn.commit()
+            finally:
+                conn.close()
+
+        # Let this worker read its own writes
+        if self.replica is not None:
+            self.replica.mark_stale()
+        return results
+
+    def write(self, *statements):
+        """Execute (sql, params) statements in one transaction, return the (lastrowid, rowcount) of the last one"""
+        return self.write_all(*statements)[-1]
+
+    @staticmethod
+    def insert_statement(name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id=None):
+        """Get the statement inserting an order, ignored if its client ID already exists"""
+        return ('''
+        INSERT INTO orders (name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (client_id) WHERE client_id IS NOT NULL DO NOTHING
+        ''', (name, kebab_type, meat, encode_ingredients(sauces), int(is_nature),
+              encode_ingredients(vegetables), timestamp, client_id))
+
+    def create(self, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id=None):
+        return self.create_many([{
+            'name': name, 'kebab_type': kebab_type, 'meat': meat, 'sauces': sauces, 'is_nature': is_nature,
+            'vegetables': vegetables, 'timestamp': timestamp, 'client_id': client_id,
+        }])[0][0]
+
+    def create_many(self, orders):
+        results = self.write_all(*[self.insert_statement(**order) for order in orders])
+
+        # Get the IDs of the orders that were already stored
+        replayed = [order['client_id'] for order, (_, rowcount) in zip(orders, results) if not rowcount]
+        existing = {}
+        if replayed:
+            rows = self.query(f"SELECT id, client_id FROM orders WHERE client_id IN ({', '.join('?' * len(replayed))})",
+                              replayed)
+            existing = {row['client_id']: row['id'] for row in rows}
+
+        return [(order_id, True) if rowcount else (existing.get(order['client_id']), False)
+                for order, (order_id, rowcount) in zip(orders, results)]
+
+    def update(self, order_id, name, kebab_type, meat, sauces, is_nature, vegetables, version=None):
+        # The version check and the update are a single statement, no lock is needed
+        _, rowcount = self.write(('''
+        UPDATE orders
+        SET name = ?, kebab_type = ?, meat = ?, sauces = ?,
+            is_nature = ?, vegetables = ?, version = version + 1
+        WHERE id = ? AND (? IS NULL OR version = ?)
+        ''', (name, kebab_type, meat, encode_ingredients(sauces), int(is_nature),
+              encode_ingredients(vegetables), order_id, version, version)))
+        return rowcount > 0
+
+    def delete(self, order_id):
+        _, rowcount = self.write(('DELETE FROM orders WHERE id = ?', (order_id,)))
+        return rowcount > 0
+
+    def get(self, order_id):
+        rows = self.query('SELECT * FROM orders WHERE id = ?', (order_id,))
+        return decode_order(rows[0]) if rows else None
+
+    def list_window(self, since):
+        rows = self.query(self.WINDOW_SQL, (since,))
+        return [decode_order(row) for row in rows]
+
+    def aggregate(self, since):
+        rows = self.query(self.AGGREGATE_SQL, (since,))
+
+        counts = []
+        for row in rows:
+            is_nature = bool(row['is_nature'])
+            config = (row['kebab_type'], row['meat'], decode_ingredients(row['sauces']), is_nature,
+                      () if is_nature else decode_ingredients(row['vegetables']))
+            counts.append((config, row['count']))
+        return counts
+
+    def changes_since(self, after, limit):
+        rows = self.query(self.CHANGES_SQL, (after, limit))
+        horizon, latest = self.query('''
+        SELECT (SELECT value FROM kos_meta WHERE key = 'events_horizon'),
+               (SELECT seq FROM sqlite_sequence WHERE name = 'order_events')
+        ''', ())[0]
+        return [event_row_to_event(row) for row in rows], latest or 0, horizon
+
+    def latest_seq(self):
+        rows = self.query("SELECT seq FROM sqlite_sequence WHERE name = 'order_events'", ())
+        return rows[0][0] if rows else 0
+
+    def change_counter(self):
+        # The cached values are computed from the copy, key them by the counter the copy holds
+        # so they are computed again once the copy has the changes of the other workers
+        if self.replica is not None:
+            return self.replica.refresh_if_stale().changes
+        return self.changes.get()
+
+    def warm_up(self):
+        # Read the whole file so its pages are in the OS page cache before the first request
+        size = 0
+        with open(self.db_path, 'rb') as db_file:
+            while chunk := db_file.read(1 << 20):
+                size += len(chunk)
+
+        # Fill the in-memory copy
+        self.latest_seq()
+        return size
+
+    def checkpoint(self):
+        # Copies the pages of the WAL into the database file so the WAL doesn't grow,
+        # does nothing with the other journal modes
+        conn = self.connect()
+        try:
+            conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        finally:
+            conn.close()
+
+    def search(self, text, limit):
+        words = search_words(text)
+        if not words:
+            return []
+
+        if not self.has_search_index:
+            rows = self.query(f'''
+            SELECT {self.ORDER_COLUMNS} FROM orders WHERE name LIKE ?
+            UNION ALL
+            SELECT {self.ORDER_COLUMNS} FROM orders_archive WHERE name LIKE ?
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (f'%{text}%', f'%{text}%', limit))
+            return [decode_order(row) for row in rows]
+
+        # Quote each word so the text can't use the FTS5 query syntax, and match it as a prefix
+        match = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+        rows = self.query(f'''
+        SELECT {self.ORDER_COLUMNS} FROM orders
+        WHERE id IN (SELECT rowid FROM order_search WHERE order_search MATCH ?)
+        UNION ALL
+        SELECT {self.ORDER_COLUMNS} FROM orders_archive
+        WHERE id IN (SELECT rowid FROM order_search WHERE order_search MATCH ?)
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+        ''', (match, match, limit))
+        return [decode_order(row) for row in rows]
+
+    def last_orders(self, name, limit):
+        rows = self.query(self.LAST_ORDERS_SQL, (name, name, limit))
+        return [decode_order(row) for row in rows]
+
+    def reorder(self, order_id, timestamp):
+        order_id, created = self.write((f'''
+        INSERT INTO orders (name, kebab_type, meat, sauces, is_nature, vegetables, timestamp)
+        SELECT name, kebab_type, meat, sauces, is_nature, vegetables, ? FROM (
+            SELECT {self.ORDER_COLUMNS} FROM orders WHERE id = ?
+            UNION ALL
+            SELECT {self.ORDER_COLUMNS} FROM orders_archive WHERE id = ?
+        )
+        LIMIT 1
+        ''', (timestamp, order_id, order_id)))
+        return order_id if created else None
+
+    def bulk_delete(self, selection):
+        where, params = selection.to_sql()
+        _, deleted = self.write((f'DELETE FROM orders WHERE {where}', params))
+        return deleted
+
+    def bulk_archive(self, selection):
+        where, params = selection.to_sql()
+        _, archived = self.write(
+            (f'''
+            INSERT INTO orders_archive (id, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, archived_at)
+            SELECT id, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, ?
+            FROM orders WHERE {where}
+            ''', [datetime.now().strftime(TIMESTAMP_FORMAT)] + params),
+            (f'DELETE FROM orders WHERE {where}', params))
+        return archived
+
+    def bulk_duplicate(self, selection, timestamp):
+        where, params = selection.to_sql()
+        _, created = self.write((f'''
+        INSERT INTO orders (name, kebab_type, meat, sauces, is_nature, vegetables, timestamp)
+        SELECT name, kebab_type, meat, sauces, is_nature, vegetables, ? FROM (
+            SELECT id, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp
+            FROM orders WHERE {where}
+            UNION ALL
+            SELECT id, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp
+            FROM orders_archive WHERE {where}
+        )
+        ORDER BY timestamp, id
+        ''', [timestamp] + params + params))
+        return created
+
+    def compact_events(self, before):
+        _, deleted = self.write(
+            ('''
+            UPDATE kos_meta
+            SET value = MAX(value, (SELECT IFNULL(MAX(seq), 0) FROM order_events WHERE timestamp < ?))
+            WHERE key = 'events_horizon'
+            ''', (before,)),
+            ('''
+            DELETE FROM order_events
+            WHERE seq <= (SELECT value FROM kos_meta WHERE key = 'events_horizon')
+            ''', ()))
+        return deleted
+
+    def check_query_plans(self):
+        """Check that the hot queries read the tables through indexes, raise AssertionError otherwise"""
+        conn = self.connect()
+        try:
+            return [assert_uses_index(conn, sql, params) for sql, params in self.HOT_QUERIES]
+        finally:
+            conn.close()
+
+    def get_metrics(self):
+        metrics = {'slow_queries': self.slow_queries.get_metrics(), 'change_counter': self.changes.get_metrics()}
+        if self.writer is not None:
+            metrics['group_commit'] = dict(self.writer.metrics)
+        if self.replica is not None:
+            metrics['read_replica'] = self.replica.get_metrics()
+        return metrics
+
+
+class InMemoryOrderRepository(OrderRepository):
+    """Orders stored in process memory, for tests and benchmarks of the web layer
+
+    Orders are indexed by ID, and by (timestamp, id) in a sorted list so that the
+    recent window is found with a binary search.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.archive = {}
+        self.client_ids = {}
+        self.by_time = []
+        self.next_id = 1
+        self.events = []
+        self.last_seq = 0
+        self.events_horizon = 0
+
+    def log_event(self, op, order_id, order):
+        """Append an event to the order event log, the lock must be held"""
+        self.last_seq += 1
+        self.events.append({
+            'seq': self.last_seq,
+            'op': op,
+            'order_id': order_id,
+            'order': order,
+            'timestamp': datetime.now().strftime(TIMESTAMP_FORMAT),
+        })
+
+    def create(self, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id=None):
+        with self.lock:
+            return self.insert(name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id)[0]
+
+    def create_many(self, orders):
+        with self.lock:
+            return [self.insert(**order) for order in orders]
+
+    def insert(self, name, kebab_type, meat, sauces, is_nature, vegetables, timestamp, client_id=None):
+        """Add a new order to the live orders, the lock must be held
+
+        Returns the (order ID, created) of the order.
+        """
+        if client_id is not None and self.client_ids.get(client_id) in self.orders:
+            return self.client_ids[client_id], False
+
+        order_id = self.next_id
+        self.next_id += 1
+        self.orders[order_id] = make_order(order_id, name, kebab_type, meat, sauces, is_nature, vegetables,
+                                           timestamp, client_id)
+        bisect.insort(self.by_time, (timestamp, order_id))
+        if client_id is not None:
+            self.client_ids[client_id] = order_id
+        self.log_event('create', order_id, self.orders[order_id])
+        return order_id, True
+
+    def update(self, order_id, name, kebab_type, meat, sauces, is_nature, vegetables, version=None):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None or (version is not None and order.version != version):
+                return False
+            order = self.orders[order_id] = make_order(order_id, name, kebab_type, meat, sauces, is_nature,
+                                                       vegetables, order.timestamp, order.client_id,
+                                                       order.version + 1)
+            self.log_event('update', order_id, order)
+            return True
+
+    def delete(self, order_id):
+        with self.lock:
+            if order_id not in self.orders:
+                return False
+            self.remove(order_id)
+            return True
+
+    def get(self, order_id):
+        with self.lock:
+            return self.orders.get(order_id)
+
+    def window_ids(self, since):
+        """Get the IDs of the orders placed after `since`, newest first"""
+        start = bisect.bisect_right(self.by_time, (since, math.inf))
+        return [order_id for _, order_id in reversed(self.by_time[start:])]
+
+    def list_window(self, since):
+        with self.lock:
+            return [self.orders[order_id] for order_id in self.window_ids(since)]
+
+    def aggregate(self, since):
+        with self.lock:
+            counts = {}
+            for order_id in self.window_ids(since):
+                config = self.orders[order_id].config
+                counts[config] = counts.get(config, 0) + 1
+            return list(counts.items())
+
+    def changes_since(self, after, limit):
+        with self.lock:
+            start = bisect.bisect_right(self.events, after, key=lambda event: event['seq'])
+            return self.events[start:start + limit], self.last_seq, self.events_horizon
+
+    def compact_events(self, before):
+        with self.lock:
+            # Events are appended in timestamp order, so the old ones are at the start
+            end = bisect.bisect_left(self.events, before, key=lambda event: event['timestamp'])
+            if end:
+                self.events_horizon = max(self.events_horizon, self.events[end - 1]['seq'])
+                del self.events[:end]
+            return end
+
+    def latest_seq(self):
+        return self.last_seq
+
+    def change_counter(self):
+        # Every change of the orders appends an event
+        return self.last_seq
+
+    def history(self):
+        """Get the live and archived orders, the lock must be held"""
+        return list(self.orders.values()) + [order for order, _ in self.archive.values()]
+
+    def search(self, text, limit):
+        words = search_words(text)
+        with self.lock:
+            found = []
+            for order in self.history():
+                order_words = search_words(' '.join((order.name, order.kebab_type, order.meat)
+                                                    + order.sauces + order.vegetables))
+                if words and all(any(order_word.startswith(word) for order_word in order_words)
+                                 for word in words):
+                    found.append(order)
+        found.sort(key=lambda order: (order.timestamp, order.id), reverse=True)
+        return found[:limit]
+
+    def last_orders(self, name, limit):
+        with self.lock:
+            found = [order for order in self.history() if order.name == name]
+        found.sort(key=lambda order: (order.timestamp, order.id), reverse=True)
+        return found[:limit]
+
+    def reorder(self, order_id, timestamp):
+        with self.lock:
+            order = self.orders.get(order_id) or self.archive.get(order_id, (None, None))[0]
+            if order is None:
+                return None
+            return self.insert(order.name, order.kebab_type, order.meat, order.sauces,
+                               order.is_nature, order.vegetables, timestamp)[0]
+
+    def archive_order(self, order_id, archived_at):
+        """Move an order to the archive, the lock must be held"""
+        # Like the archive table, the archive doesn't keep the client IDs and versions
+        order = self.remove(order_id)._replace(client_id=None, version=None)
+        self.archive[order_id] = (order, archived_at)
+
+    def remove(self, order_id):
+        """Remove an order from the live orders, the lock must be held"""
+        order = self.orders.pop(order_id)
+        del self.by_time[bisect.bisect_left(self.by_time, (order.timestamp, order_id))]
+        self.log_event('delete', order_id, None)
+        return order
+
+    def bulk_delete(self, selection):
+        with self.lock:
+            selected = [order_id for order_id, order in self.orders.items() if selection.matches(order)]
+            for order_id in selected:
+                self.remove(order_id)
+            return len(selected)
+
+    def bulk_archive(self, selection):
+        with self.lock:
+            archived_at = datetime.now().strftime(TIMESTAMP_FORMAT)
+            selected = [order_id for order_id, order in self.orders.items() if selection.matches(order)]
+            for order_id in selected:
+                self.archive_order(order_id, archived_at)
+            return len(selected)
+
+    def bulk_duplicate(self, selection, timestamp):
+        with self.lock:
+            selected = [order for order in self.history() if selection.matches(order)]
+            selected.sort(key=lambda order: (order.timestamp, order.id))
+            for order in selected:
+                self.insert(order.name, order.kebab_type, order.meat, order.sauces,
+                            order.is_nature, order.vegetables, timestamp)
+            return len(selected)
+
+
+# Labels of the weekdays, Monday first like datetime.weekday()
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+class ColumnarHistory:
+    """Columnar snapshots of all the live and archived orders, aggregated with NumPy
+
+    export() writes each column of the orders to a .npy file: kebab types and meats
+    as codes into their category lists, sauces and vegetables as bit masks over
+    theirs, and timestamps as int64 seconds since the epoch of their local time.
+    The category lists start with the menu, values of old orders missing from the
+    menu are appended. Each export goes to a new directory and `current.json` is
+    then replaced to point to it, so readers always memory map a complete export.
+
+    count_by() gives the same counts as count_by_sql() on the database, up to the
+    orders written since the last export.
+    """
+
+    COLUMN_TYPES = {
+        'kebab_type': 'uint16',
+        'meat': 'uint16',
+        'sauces': 'uint64',
+        'vegetables': 'uint64',
+        'timestamp': 'int64',
+    }
+    GROUPS = ['kebab_type', 'meat', 'sauce', 'vegetable', 'weekday', 'hour', 'month', 'year']
+
+    # Column holding the ingredients counted by each ingredient group
+    INGREDIENT_GROUPS = {'sauce': 'sauces', 'vegetable': 'vegetables'}
+
+    # Exports kept on disk, a worker may still be reading the previous one
+    KEEP = 2
+
+    HISTORY_SQL = '''
+    SELECT kebab_type, meat, sauces, is_nature, vegetables, COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), 0)
+    FROM orders
+    UNION ALL
+    SELECT kebab_type, meat, sauces, is_nature, vegetables, COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), 0)
+    FROM orders_archive
+    '''
+
+    # SQL expression of the label of each group, the ingredient groups are counted one ingredient at a time
+    SQL_GROUPS = {
+        'kebab_type': 'kebab_type',
+        'meat': 'meat',
+        'weekday': "(CAST(strftime('%w', timestamp) AS INTEGER) + 6) % 7",
+        'hour': "CAST(strftime('%H', timestamp) AS INTEGER)",
+        'month': "strftime('%Y-%m', timestamp)",
+        'year': "strftime('%Y', timestamp)",
+    }
+
+    def __init__(self, directory, menu):
+        self.directory = directory
+        self.menu = menu
+        self.lock = threading.Lock()
+        self.loaded = None
+        self.metrics = {'exports': 0, 'export_seconds': None, 'rows': None, 'loads': 0}
+
+    def export(self, db_path):
+        """Write a new export of the orders of a database, return its metadata"""
+        start = time.perf_counter()
+        categories = {column: list(self.menu[column]) for column in self.COLUMN_TYPES if column in self.menu}
+        codes = {column: {value: code for code, value in enumerate(values)} for column, values in categories.items()}
+        masks = {'sauces': {}, 'vegetables': {}}
+
+        def code(column, value):
+            found = codes[column].get(value)
+            if found is None:
+                found = codes[column][value] = len(categories[column])
+                categories[column].append(value)
+            return found
+
+        def mask(column, encoded):
+            found = masks[column].get(encoded)
+            if found is None:
+                found = 0
+                for value in decode_ingredients(encoded):
+                    found |= 1 << code(column, value)
+                if found >> 64:
+                    raise ValueError(f"More than 64 different {column} to export")
+                masks[column][encoded] = found
+            return found
+
+        columns = {column: [] for column in self.COLUMN_TYPES}
+        conn = sqlite3.connect(db_path)
+        try:
+            for kebab_type, meat, sauces, is_nature, vegetables, timestamp in conn.execute(self.HISTORY_SQL):
+                columns['kebab_type'].append(code('kebab_type', kebab_type))
+                columns['meat'].append(code('meat', meat))
+                columns['sauces'].append(mask('sauces', sauces or ''))
+                columns['vegetables'].append(0 if is_nature else mask('vegetables', vegetables or ''))
+                columns['timestamp'].append(timestamp)
+        finally:
+            conn.close()
+
+        name = 'columns-' + datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)
+        for column, values in columns.items():
+            numpy.save(os.path.join(path, column + '.npy'), numpy.array(values, dtype=self.COLUMN_TYPES[column]))
+        meta = {
+            'name': name,
+            'rows': len(columns['timestamp']),
+            'categories': categories,
+            'exported_at': datetime.now().strftime(TIMESTAMP_FORMAT),
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+        current_path = os.path.join(self.directory, 'current.json')
+        with open(current_path + '.tmp', 'w') as current_file:
+            json.dump({'name': name}, current_file)
+        os.replace(current_path + '.tmp', current_path)
+
+        exports = sorted(entry for entry in os.listdir(self.directory) if entry.startswith('columns-'))
+        for old in exports[:-self.KEEP]:
+            shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+        self.metrics['exports'] += 1
+        self.metrics['export_seconds'] = time.perf_counter() - start
+        self.metrics['rows'] = meta['rows']
+        return meta
+
+    def load(self):
+        """Memory map the columns of the latest export, return (metadata, columns) or None without export"""
+        current_path = os.path.join(self.directory, 'current.json')
+        try:
+            changed_at = os.stat(current_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self.lock:
+            if self.loaded is None or self.loaded[0] != changed_at:
+                with open(current_path) as current_file:
+                    path = os.path.join(self.directory, json.load(current_file)['name'])
+                with open(os.path.join(path, 'meta.json')) as meta_file:
+                    meta = json.load(meta_file)
+                # Empty files can't be memory mapped
+                columns = {column: numpy.load(os.path.join(path, column + '.npy'), mmap_mode='r' if meta['rows'] else None)
+                           for column in self.COLUMN_TYPES}
+                self.loaded = (changed_at, meta, columns)
+                self.metrics['loads'] += 1
+            return self.loaded[1:]
+
+    def count_by(self, group, since=None, until=None):
+        """Count the orders placed between `since` and `until` included, by group
+
+        Returns the (label, count) of the labels with orders, or None without export.
+        """
+        loaded = self.load()
+        if loaded is None:
+            return None
+        meta, columns = loaded
+
+        selected = None
+        timestamps = columns['timestamp']
+        if since is not None:
+            selected = timestamps >= epoch_seconds(since)
+        if until is not None:
+            before = timestamps <= epoch_seconds(until)
+            selected = before if selected is None else selected & before
+
+        def values(column):
+            return columns[column] if selected is None else columns[column][selected]
+
+        if group in ('kebab_type', 'meat'):
+            labels = meta['categories'][group]
+            counts = numpy.bincount(values(group), minlength=len(labels))
+        elif group in self.INGREDIENT_GROUPS:
+            column = self.INGREDIENT_GROUPS[group]
+            labels = meta['categories'][column]
+            masks = values(column)
+            counts = [numpy.count_nonzero(masks & numpy.uint64(1 << code)) for code in range(len(labels))]
+        elif group == 'weekday':
+            # 1970-01-01 was a Thursday
+            labels = WEEKDAYS
+            counts = numpy.bincount((values('timestamp') // 86400 + 3) % 7, minlength=7)
+        elif group == 'hour':
+            labels = range(24)
+            counts = numpy.bincount(values('timestamp') // 3600 % 24, minlength=24)
+        else:
+            unit = 'M' if group == 'month' else 'Y'
+            periods = values('timestamp').astype('datetime64[s]').astype(f'datetime64[{unit}]').astype('int64')
+            if not len(periods):
+                return []
+            first = periods.min()
+            counts = numpy.bincount(periods - first)
+            labels = [str(numpy.datetime64(int(first) + offset, unit)) for offset in range(len(counts))]
+
+        return [(label, int(count)) for label, count in zip(labels, counts) if count]
+
+    def count_by_sql(self, conn, group, since=None, until=None):
+        """Count the orders placed between `since` and `until` included by group, with SQL on the database"""
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('timestamp <= ?')
+            params.append(until)
+        history = '''
+        SELECT kebab_type, meat, sauces, is_nature, vegetables, timestamp FROM orders
+        UNION ALL
+        SELECT kebab_type, meat, sauces, is_nature, vegetables, timestamp FROM orders_archive
+        '''
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        if group in self.INGREDIENT_GROUPS:
+            column = self.INGREDIENT_GROUPS[group]
+            labels = list(self.menu[column])
+            for (encoded,) in conn.execute(f'SELECT DISTINCT {column} FROM ({history})'):
+                labels.extend(value for value in decode_ingredients(encoded or '') if value not in labels)
+            if not labels:
+                return []
+            nature = 'NOT is_nature AND ' if column == 'vegetables' else ''
+            sums = ', '.join(f"COALESCE(SUM({nature}instr(',' || {column} || ',', ?) > 0), 0)" for _ in labels)
+            counts = conn.execute(f'SELECT {sums} FROM ({history}) {where}',
+                                  [f',{label},' for label in labels] + params).fetchone()
+            return [(label, count) for label, count in zip(labels, counts) if count]
+
+        rows = conn.execute(f'''
+        SELECT {self.SQL_GROUPS[group]} AS label, COUNT(*) FROM ({history}) {where}
+        GROUP BY label ORDER BY label
+        ''', params).fetchall()
+        if group in self.menu:
+            # Menu order first, like the categories of the exports
+            positions = {label: position for position, label in enumerate(self.menu[group])}
+            rows.sort(key=lambda row: positions.get(row[0], len(positions)))
+        if group == 'weekday':
+            return [(WEEKDAYS[label], count) for label, count in rows]
+        return [(label, count) for label, count in rows]
+
+    def get_metrics(self):
+        return dict(self.metrics, numpy=numpy is not None)
+
+
+def epoch_seconds(timestamp):
+    """Get the seconds since the epoch of a timestamp, as if its local time was UTC"""
+    return int((datetime.strptime(timestamp, TIMESTAMP_FORMAT) - datetime(1970, 1, 1)).total_seconds())
+
+
+class AppendLog:
+    """Append-only log of JSON records, written and fsynced in batches by a background thread
+
+    A record is durable at most about `max_loss` seconds after it is appended, the
+    records appended meanwhile share one write and one fsync. With a `max_loss` of 0
+    the log is written as soon as there is something to write, and sync() waits for it.
+    """
+
+    def __init__(self, path, max_loss):
+        self.path = path
+        self.max_loss = max_loss
+        self.cond = threading.Condition()
+        self.file_lock = threading.Lock()
+        self.buffer = []
+        self.appended = 0
+        self.synced = 0
+        self.closed = False
+        self.file = open(path, 'a', encoding='utf-8')
+        self.metrics = {'records': 0, 'fsyncs': 0, 'largest_batch': 0, 'fsync_seconds': 0.0}
+        self.thread = threading.Thread(target=self.run, name='append-log', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def read(path):
+        """Read the records of a log, a torn last record is ignored"""
+        if not os.path.exists(path):
+            return []
+
+        records = []
+        with open(path, encoding='utf-8') as log_file:
+            for line in log_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def append(self, record):
+        """Queue a record for the next batch"""
+        with self.cond:
+            self.buffer.append(json.dumps(record) + '\n')
+            self.appended += 1
+            self.cond.notify_all()
+
+    def sync(self):
+        """Wait until the records appended so far are fsynced"""
+        with self.cond:
+            position = self.appended
+            while self.synced < position and not self.closed:
+                self.cond.wait()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.closed:
+                    self.cond.wait()
+                if not self.buffer:
+                    return
+
+            # Hold the file while a batch is written, rewrite() replaces it
+            with self.file_lock:
+                with self.cond:
+                    lines = self.buffer
+                    self.buffer = []
+                    position = self.appended
+                if not lines:
+                    # Written by rewrite() in the meantime
+                    continue
+
+                start = time.perf_counter()
+                self.file.write(''.join(lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+            with self.cond:
+                self.synced = max(self.synced, position)
+                self.metrics['records'] += len(lines)
+                self.metrics['fsyncs'] += 1
+                self.metrics['largest_batch'] = max(self.metrics['largest_batch'], len(lines))
+                self.metrics['fsync_seconds'] += time.perf_counter() - start
+                self.cond.notify_all()
+
+            # Let the next batch build up, this is the loss window
+            if self.max_loss:
+                time.sleep(self.max_loss)
+
+    def rewrite(self, get_records, lock):
+        """Replace the log with the records returned by `get_records`
+
+        `get_records` is called holding `lock`, which the appenders hold while they
+        append, and must return every record still buffered. The new log is written and
+        fsynced after `lock` is released, the records appended meanwhile are written after it.
+        """
+        with self.file_lock:
+            with lock:
+                records = get_records()
+                with self.cond:
+                    self.buffer = []
+                    position = self.appended
+
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as temp_file:
+                temp_file.write(''.join(json.dumps(record) + '\n' for record in records))
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.path)
+            self.file.close()
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+        with self.cond:
+            self.synced = max(self.synced, position)
+            self.cond.notify_all()
+
+    def close(self):
+        """Write the buffered records and stop the background thread"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        with self.file_lock:
+            self.file.close()
+
+
+class EventModeOrderRepository(InMemoryOrderRepository):
+    """In-memory orders made durable by an append log and periodic SQLite snapshots
+
+    For events taking hundreds of orders in a few minutes: the orders in memory are
+    authoritative, every change is appended to a log at `log_path` fsynced in batches,
+    so at most about `max_loss` seconds of acknowledged changes are lost in a crash.
+    Every `snapshot_interval` seconds the logged changes are applied to the SQLite
+    database in one transaction and the log is truncated. On start, the orders are
+    loaded from the database and the changes of the log not in it yet are replayed.
+
+    The orders live in this process, so the app must run in a single worker: a second
+    process using the same log refuses to start instead of handing out the same ids.
+    A logged change the database refuses, like an order breaking a constraint, is
+    moved to a quarantine file next to the log so the next snapshots aren't blocked.
+    """
+
+    # Errors of a record itself, the other ones like a locked database fail the whole snapshot
+    REJECTED_RECORD_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError,
+                              sqlite3.DataError, KeyError, TypeError, ValueError)
+
+    def __init__(self, db_path, log_path, max_loss=0.05, snapshot_interval=30, journal_mode='wal'):
+        super().__init__()
+        # On a file next to the log, rewrite() replaces the log and would drop a lock held on it
+        self.lock_file = self.acquire_lock(log_path + '.lock')
+        self.database = SQLiteOrderRepository(db_path, journal_mode=journal_mode)
+        self.log_path = log_path
+        self.quarantine_path = log_path + '.rejected'
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.snapshot_metrics = {'snapshots': 0, 'records': 0, 'last_seconds': None, 'failures': 0,
+                                 'last_error': None, 'recovered_records': 0, 'quarantined': 0}
+
+        # Logged changes not in the database yet
+        self.pending = []
+        self.recover()
+
+        self.log = AppendLog(log_path, max_loss)
+        # Start from a clean log, without the torn record a crash may have left
+        self.log.rewrite(lambda: self.pending, self.lock)
+
+        self.thread = threading.Thread(target=self.run_snapshots, name='snapshots', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def acquire_lock(path):
+        """Lock the log for this process, raise RuntimeError if another one holds it"""
+        lock_file = open(path, 'a')
+        if fcntl is None:
+            return lock_file
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f'{path} is locked, event mode is already running on this log in another worker')
+
+        # Keep the file open, closing it would release the lock
+        return lock_file
+
+    def recover(self):
+        """Load the last snapshot and replay the logged changes made after it"""
+        for row in self.database.query('SELECT * FROM orders', ()):
+            order = decode_order(row)
+            self.orders[order.id] = order
+            self.by_time.append((order.timestamp, order.id))
+            if order.client_id is not None:
+                self.client_ids[order.client_id] = order.id
+        self.by_time.sort()
+
+        rows = self.database.query(
+            f'SELECT {SQLiteOrderRepository.ORDER_COLUMNS}, archived_at FROM orders_archive', ())
+        for row in rows:
+            self.archive[row['id']] = (decode_order(row), row['archived_at'])
+
+        snapshot_seq, last_id = self.database.query('''
+        SELECT (SELECT value FROM kos_meta WHERE key = 'snapshot_seq'),
+               (SELECT seq FROM sqlite_sequence WHERE name = 'orders')
+        ''', ())[0]
+        snapshot_seq = snapshot_seq or 0
+        self.next_id = (last_id or 0) + 1
+
+        self.pending = [record for record in AppendLog.read(self.log_path) if record['seq'] > snapshot_seq]
+        for record in self.pending:
+            self.apply(record)
+        self.snapshot_metrics['recovered_records'] = len(self.pending)
+
+        # The events themselves are not kept, clients of the change feed start over
+        self.last_seq = max([snapshot_seq] + [record['seq'] for record in self.pending])
+        self.events_horizon = self.last_seq
+
+    def apply(self, record):
+        """Replay a logged change, the lock must be held"""
+        order_id = record['id']
+        if record['op'] == 'delete':
+            order = self.orders.pop(order_id)
+            del self.by_time[bisect.bisect_left(self.by_time, (order.timestamp, order_id))]
+        elif record['op'] == 'archive':
+            self.archive[order_id] = (order_from_record(record['order']), record['archived_at'])
+        else:
+            order = order_from_record(record['order'])
+            if record['op'] == 'create':
+                bisect.insort(self.by_time, (order.timestamp, order_id))
+                if order.client_id is not None:
+                    self.client_ids[order.client_id] = order_id
+            self.orders[order_id] = order
+        self.next_id = max(self.next_id, order_id + 1)
+
+    def append_record(self, record):
+        """Log a change, the lock must be held"""
+        self.pending.append(record)
+        self.log.append(record)
+
+    def log_event(self, op, order_id, order):
+        super().log_event(op, order_id, order)
+        self.append_record({'seq': self.last_seq, 'op': op, 'id': order_id,
+                            'order': order._asdict() if order else None})
+
+    def archive_order(self, order_id, archived_at):
+        super().archive_order(order_id, archived_at)
+        # Same sequence number as the delete event just logged, both are in the same snapshot
+        self.append_record({'seq': self.last_seq, 'op': 'archive', 'id': order_id,
+                            'order': self.archive[order_id][0]._asdict(), 'archived_at': archived_at})
+
+    def durable(self, result):
+        """Wait until the changes are in the log if no loss is allowed, then return `result`"""
+        if self.log.max_loss == 0:
+            self.log.sync()
+        return result
+
+    def create(self, *args, **kwargs):
+        return self.durable(super().create(*args, **kwargs))
+
+    def create_many(self, orders):
+        return self.durable(super().create_many(orders))
+
+    def update(self, *args, **kwargs):
+        return self.durable(super().update(*args, **kwargs))
+
+    def delete(self, order_id):
+        return self.durable(super().delete(order_id))
+
+    def reorder(self, order_id, timestamp):
+        return self.durable(super().reorder(order_id, timestamp))
+
+    def bulk_delete(self, selection):
+        return self.durable(super().bulk_delete(selection))
+
+    def bulk_archive(self, selection):
+        return self.durable(super().bulk_archive(selection))
+
+    def bulk_duplicate(self, selection, timestamp):
+        return self.durable(super().bulk_duplicate(selection, timestamp))
+
+    def run_snapshots(self):
+        while not self.stopped.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                # The changes stay in the log, the next snapshot tries again
+                self.snapshot_metrics['failures'] += 1
+                self.snapshot_metrics['last_error'] = repr(e)
+
+    def snapshot(self):
+        """Apply the logged changes to the database and truncate the log, return how many were applied"""
+        with self.snapshot_lock:
+            with self.lock:
+                records = list(self.pending)
+            if not records:
+                return 0
+
+            start = time.perf_counter()
+            rejected = []
+            conn = self.database.connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for record in records:
+                    # A record the database refuses is set aside rather than failing every snapshot
+                    conn.execute('SAVEPOINT record')
+                    try:
+                        self.write_record(conn, record)
+                    except self.REJECTED_RECORD_ERRORS as e:
+                        conn.execute('ROLLBACK TO record')
+                        rejected.append(dict(record, error=repr(e)))
+                    conn.execute('RELEASE record')
+                conn.execute("INSERT OR REPLACE INTO kos_meta (key, value) VALUES ('snapshot_seq', ?)",
+                             (records[-1]['seq'],))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            if rejected:
+                self.quarantine(rejected)
+
+            # Changes logged during the snapshot stay in the log, which is written without
+            # holding the lock of the orders
+            def remaining():
+                del self.pending[:len(records)]
+                return self.pending
+
+            self.log.rewrite(remaining, self.lock)
+
+            self.snapshot_metrics['snapshots'] += 1
+            self.snapshot_metrics['records'] += len(records)
+            self.snapshot_metrics['last_seconds'] = time.perf_counter() - start
+            return len(records)
+
+    def quarantine(self, records):
+        """Append the records the database refused to the quarantine file next to the log"""
+        with open(self.quarantine_path, 'a', encoding='utf-8') as quarantine_file:
+            quarantine_file.write(''.join(json.dumps(record) + '\n' for record in records))
+            quarantine_file.flush()
+            os.fsync(quarantine_file.fileno())
+        self.snapshot_metrics['quarantined'] += len(records)
+        self.snapshot_metrics['last_error'] = records[-1]['error']
+
+    @staticmethod
+    def write_record(conn, record):
+        """Apply a logged change to the database"""
+        op = record['op']
+        order = record['order']
+        if op == 'delete':
+            conn.execute('DELETE FROM orders WHERE id = ?', (record['id'],))
+            return
+
+        fields = (order['name'], order['kebab_type'], order['meat'], encode_ingredients(order['sauces']),
+                  int(order['is_nature']), encode_ingredients(order['vegetables']))
+        if op == 'create':
+            conn.execute('''
+            INSERT INTO orders (name, kebab_type, meat, sauces, is_nature, vegetables, id, timestamp, client_id, version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', fields + (order['id'], order['timestamp'], order['client_id'], order['version']))
+        elif op == 'update':
+            conn.execute('''
+            UPDATE orders
+            SET name = ?, kebab_type = ?, meat = ?, sauces = ?, is_nature = ?, vegetables = ?, version = ?
+            WHERE id = ?
+            ''', fields + (order['version'], order['id']))
+        elif op == 'archive':
+            conn.execute('''
+            INSERT INTO orders_archive (name, kebab_type, meat, sauces, is_nature, vegetables, id, timestamp, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', fields + (order['id'], order['timestamp'], record['archived_at']))
+
+    def checkpoint(self):
+        self.database.checkpoint()
+
+    def close(self):
+        """Write a last snapshot and stop the background threads"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.snapshot()
+        self.log.close()
+        self.lock_file.close()
+
+    def get_metrics(self):
+        with self.lock:
+            pending = len(self.pending)
+        return dict(self.snapshot_metrics, pending_records=pending, max_loss_seconds=self.log.max_loss,
+                    log=dict(self.log.metrics))
+
+
+def create_storage(config):
+    """Create the order storage selected by the application settings"""
+    engine = config['STORAGE']
+    if engine == 'memory':
+        return InMemoryOrderRepository()
+    if engine == 'event':
+        return EventModeOrderRepository(config['DB_PATH'], config['EVENT_LOG_PATH'] or config['DB_PATH'] + '-log.jsonl',
+                                        max_loss=config['EVENT_MAX_LOSS'],
+                                        snapshot_interval=config['EVENT_SNAPSHOT_INTERVAL'],
+                                        journal_mode=config['JOURNAL_MODE'])
+    if engine == 'sqlite':
+        return SQLiteOrderRepository(config['DB_PATH'],
+                                     write_behind=config['WRITE_BEHIND'],
+                                     group_commit_max_batch=config['GROUP_COMMIT_MAX_BATCH'],
+                                     group_commit_max_delay=config['GROUP_COMMIT_MAX_DELAY'],
+                                     read_replica=config['READ_REPLICA'],
+                                     replica_max_lag=config['REPLICA_MAX_LAG'],
+                                     slow_query_seconds=config['SLOW_QUERY_SECONDS'],
+                                     journal_mode=config['JOURNAL_MODE'])
+    raise ValueError(f"Unknown storage engine: {engine}")
 
-# Initialize database when application starts
-init_db()
 
 # Kebab options
 kebab_types = ['Galette', 'Sandwich']
@@ -43,144 +2283,1009 @@ meat_options = ['Poulet', 'Boeuf&Veaux', 'Boeuf', 'Veaux', 'Vegetarian (Falafel)
 sauce_options = ['Blanche', 'Cocktail', 'Piquante']
 vegetable_options = ['Salade melee', 'Carotte', 'Choux']
 
+# Option lists of the menu by order column, the categories of the columnar history
+MENU_CATEGORIES = {
+    'kebab_type': kebab_types,
+    'meat': meat_options,
+    'sauces': sauce_options,
+    'vegetables': vegetable_options,
+}
 
-def get_recent_orders():
-    """Get orders from the past 4 hours"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    cursor = conn.cursor()
-
-    # Calculate timestamp for 4 hours ago
-    four_hours_ago = (datetime.now() - timedelta(hours=4)).strftime("%Y-%m-%d %H:%M:%S")
-
-    # Get orders from the past 4 hours
-    cursor.execute('SELECT * FROM orders WHERE timestamp > ? ORDER BY timestamp DESC', (four_hours_ago,))
-    rows = cursor.fetchall()
-
-    # Process the rows into a list of dictionaries
-    orders = []
-    for row in rows:
-        order = dict(row)
-
-        # Convert sauces string to list
-        if order['sauces']:
-            order['sauces'] = order['sauces'].split(',')
-        else:
-            order['sauces'] = []
+# Version of the menu, changes whenever one of the option lists above changes
+MENU_VERSION = hashlib.sha1(repr((kebab_types, meat_options, sauce_options, vegetable_options)).encode()).hexdigest()[:12]
 
-        # Convert vegetables string to list
-        if order['vegetables'] and not order['is_nature']:
-            order['vegetables'] = order['vegetables'].split(',')
-        else:
-            order['vegetables'] = []
+# Precomputed menu lookups used to validate and canonicalize orders
+KEBAB_TYPE_SET = frozenset(kebab_types)
+MEAT_SET = frozenset(meat_options)
+SAUCE_ORDINALS = {sauce: i for i, sauce in enumerate(sauce_options)}
+VEGETABLE_ORDINALS = {veggie: i for i, veggie in enumerate(vegetable_options)}
 
-        # Convert is_nature to boolean
-        order['is_nature'] = bool(order['is_nature'])
 
-        orders.append(order)
+def canonical_ingredients(values, ordinals, kind):
+    """Validate a list of ingredients and return them without duplicates in menu order"""
+    unique = set(values)
+    unknown = unique.difference(ordinals)
+    if unknown:
+        raise ValueError(f"Unknown {kind}: {', '.join(sorted(unknown))}")
+    return tuple(sorted(unique, key=ordinals.__getitem__))
 
-    conn.close()
-    return orders
 
+def validate_order(kebab_type, meat, sauces, vegetables):
+    """Validate an order against the menu and return its canonical ingredients
 
-def get_order_by_id(order_id):
-    """Get a specific order by ID"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    Raises ValueError if the kebab type, the meat or one of the ingredients is not on the menu.
+    """
+    if kebab_type not in KEBAB_TYPE_SET:
+        raise ValueError(f"Unknown kebab type: {kebab_type}")
+    if meat not in MEAT_SET:
+        raise ValueError(f"Unknown meat: {meat}")
 
-    cursor.execute('SELECT * FROM orders WHERE id = ?', (order_id,))
-    row = cursor.fetchone()
+    return (canonical_ingredients(sauces, SAUCE_ORDINALS, 'sauce'),
+            canonical_ingredients(vegetables, VEGETABLE_ORDINALS, 'vegetable'))
 
-    if row:
-        order = dict(row)
 
-        # Convert sauces string to list
-        if order['sauces']:
-            order['sauces'] = order['sauces'].split(',')
-        else:
-            order['sauces'] = []
+# Interned summary keys of the order configurations seen so far
+config_keys = {}
+MAX_CONFIG_KEYS = 4096
 
-        # Convert vegetables string to list
-        if order['vegetables'] and not order['is_nature']:
-            order['vegetables'] = order['vegetables'].split(',')
+
+def order_config_key(kebab_type, meat, sauces, is_nature, vegetables):
+    """Get the interned summary key of an order configuration"""
+    config = (kebab_type, meat, tuple(sauces), bool(is_nature), tuple(vegetables))
+    key = config_keys.get(config)
+    if key is None:
+        # Get vegetables text
+        if is_nature:
+            veg_text = "Nature"
         else:
-            order['vegetables'] = []
+            veg_text = ', '.join(vegetables) if vegetables else "None"
 
-        # Convert is_nature to boolean
-        order['is_nature'] = bool(order['is_nature'])
+        sauce_text = ', '.join(sauces) if sauces else "None"
 
-        conn.close()
-        return order
+        key = sys.intern(f"Kebab {kebab_type} {meat} {veg_text} {sauce_text}")
 
-    conn.close()
-    return None
+        # Old rows written before validation may hold arbitrary values, keep the table bounded
+        if len(config_keys) >= MAX_CONFIG_KEYS:
+            config_keys.clear()
+        config_keys[config] = key
+    return key
 
 
-def generate_text_summary(orders):
-    """Generate a text summary of orders for phone ordering"""
-    if not orders:
-        return "No orders to summarize."
+def window_start():
+    """Get the timestamp of the start of the recent window, 4 hours ago"""
+    return (datetime.now() - timedelta(hours=4)).strftime(TIMESTAMP_FORMAT)
+
+
+def search_words(text):
+    """Split a search text into lowercase words, without accents"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r'\w+', text)
+
+
+def get_recent_orders():
+    """Get orders from the past 4 hours, the list is shared and must not be modified"""
+    storage = get_storage()
+    return get_state().recent_orders_cache.get(storage.change_counter(), 'window',
+                                               lambda: storage.list_window(window_start()))
+
+
+def get_order_by_id(order_id):
+    """Get a specific order by ID"""
+    return get_storage().get(order_id)
+
 
-    # Check if konami code was activated via a query parameter (for demonstration)
-    # This is a workaround since we can't directly communicate JS state to Python
-    # In a real app, you might use a session variable or other state management
-    konami_active = False
+# Sauce names used by each summary variant, the konami one is the easter egg of the index page
+SUMMARY_VARIANTS = {
+    'standard': {},
+    'konami': {'Blanche': 'Planche', 'Cocktail': 'Coque-tel'},
+}
+
+# Maximum length of a text message of the SMS summary
+SMS_LENGTH = 160
+
+
+def summary_lines(config_counts, variant):
+    """Get the total and the (count, summary key, configuration) of the counted configurations"""
+    aliases = SUMMARY_VARIANTS[variant]
 
     # Create a dictionary to count identical orders
     order_counts = {}
+    configs = {}
     total_kebabs = 0
 
-    # First, collect all orders in a format that can be counted
-    for order in orders:
-        # Get vegetables text
-        if order['is_nature']:
-            veg_text = "Nature"
-        else:
-            veg_text = ', '.join(order['vegetables']) if order['vegetables'] else "None"
-
-        # Get sauces text with Konami code transformation if active
-        sauces = []
-        for sauce in order['sauces']:
-            if konami_active and sauce == 'Blanche':
-                sauces.append('Planche')
-            elif konami_active and sauce == 'Cocktail':
-                sauces.append('Coque-tel')
-            else:
-                sauces.append(sauce)
+    # First, collect all configurations in a format that can be counted
+    for config, count in config_counts:
+        kebab_type, meat, sauces, is_nature, vegetables = config
 
-        sauce_text = ', '.join(sauces) if sauces else "None"
+        # Get sauces with the names of the variant
+        sauces = [aliases.get(sauce, sauce) for sauce in sauces]
 
-        # Create a unique key for this order configuration
-        order_key = f"Kebab {order['kebab_type']} {order['meat']} {veg_text} {sauce_text}"
+        # Get the interned key for this order configuration
+        order_key = order_config_key(kebab_type, meat, sauces, is_nature, vegetables)
 
         # Increment the count for this order configuration
-        if order_key in order_counts:
-            order_counts[order_key] += 1
-        else:
-            order_counts[order_key] = 1
+        order_counts[order_key] = order_counts.get(order_key, 0) + count
+        configs.setdefault(order_key, (kebab_type, meat, sauces, is_nature, vegetables))
+
+        total_kebabs += count
+
+    return total_kebabs, [(count, order_key, configs[order_key]) for order_key, count in order_counts.items()]
+
+
+def format_summary_line(count, order_key):
+    """Format a summary line, if there's more than one identical order the count is at the beginning"""
+    return f"*{count} {order_key}" if count > 1 else order_key
 
-        total_kebabs += 1
+
+def summarize_order_configs(config_counts, variant='standard'):
+    """Generate the text summary for phone ordering from counted order configurations"""
+    if not config_counts:
+        return "No orders to summarize."
+
+    total_kebabs, lines = summary_lines(config_counts, variant)
 
     # Generate the header with total count
     summary = f"KEBAB ORDERS: (TOTAL: {total_kebabs})"
 
     # Now generate the summary with counts
-    for order_key, count in order_counts.items():
-        # If there's more than one identical order, add the count at the beginning
-        if count > 1:
-            summary += f"\n*{count} {order_key}"
+    for count, order_key, _ in lines:
+        summary += f"\n{format_summary_line(count, order_key)}"
+
+    return summary
+
+
+def summarize_order_configs_sms(config_counts, variant='standard'):
+    """Generate the summary as numbered text messages of at most SMS_LENGTH characters"""
+    summary = summarize_order_configs(config_counts, variant)
+
+    # Fill each message with whole lines, keeping room for the "(1/9) " numbering
+    room = SMS_LENGTH - len("(99/99) ")
+    messages = []
+    current = ''
+    for line in summary.split('\n'):
+        while len(line) > room:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(line[:room])
+            line = line[room:]
+        if current and len(current) + 1 + len(line) > room:
+            messages.append(current)
+            current = line
         else:
-            summary += f"\n{order_key}"
+            current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+
+    return '\n\n'.join(f"({i}/{len(messages)}) {message}" for i, message in enumerate(messages, 1))
+
+
+def summarize_order_configs_by_type(config_counts, variant='standard'):
+    """Generate the text summary with the orders grouped by kebab type"""
+    if not config_counts:
+        return "No orders to summarize."
+
+    total_kebabs, lines = summary_lines(config_counts, variant)
+    groups = {kebab_type: [] for kebab_type in kebab_types}
+    for count, order_key, config in lines:
+        groups.setdefault(config[0], []).append((count, order_key))
+
+    summary = f"KEBAB ORDERS: (TOTAL: {total_kebabs})"
+    for kebab_type, group in groups.items():
+        if not group:
+            continue
+        summary += f"\n\n{kebab_type.upper()} ({sum(count for count, _ in group)})"
+        for count, order_key in group:
+            summary += f"\n{format_summary_line(count, order_key)}"
 
     return summary
 
 
-@app.route('/')
-def index():
-    # Get recent orders from the database
-    orders = get_recent_orders()
+def summarize_order_configs_json(config_counts, variant='standard'):
+    """Generate the summary as a JSON document"""
+    total_kebabs, lines = summary_lines(config_counts, variant)
+    return json.dumps({
+        'total': total_kebabs,
+        'items': [{
+            'count': count,
+            'kebab_type': kebab_type,
+            'meat': meat,
+            'sauces': list(sauces),
+            'is_nature': bool(is_nature),
+            'vegetables': list(vegetables),
+            'text': order_key,
+        } for count, order_key, (kebab_type, meat, sauces, is_nature, vegetables) in lines],
+    })
+
+
+# Summary formats, with their renderer and mimetype
+SUMMARY_FORMATS = {
+    'phone': (summarize_order_configs, "text/plain"),
+    'sms': (summarize_order_configs_sms, "text/plain"),
+    'by_type': (summarize_order_configs_by_type, "text/plain"),
+    'json': (summarize_order_configs_json, "application/json"),
+}
+
+
+class PendingCall:
+    """Computation running in a SingleFlight, waited for by the other callers of its key"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one computation of each key at a time
+
+    The first caller of a key runs the computation, the callers of the same key
+    arriving while it runs wait for it and get the same result or exception. A
+    burst of identical requests after a write or a cache expiry then runs one query
+    instead of one each. Results aren't kept, caching them is up to the caller.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, compute):
+        """Get the result of `compute`, or of the computation of the same key already running"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = PendingCall()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = compute()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+class VersionedCache:
+    """Cache of values computed from the orders, keyed by (data version, key)
+
+    Only the entries of the latest data version are kept. As orders also leave the
+    recent window with time, an entry is computed again after `max_age` seconds.
+    Concurrent misses of the same entry share one computation.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.version = None
+        self.entries = {}
+        self.flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, key, render):
+        """Get a cached value, computing it with `render` if it isn't cached"""
+        now = time.monotonic()
+        entry = self.entries.get(key) if version == self.version else None
+        if entry is not None and now - entry[0] < self.max_age:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return self.flights.do((version, key), lambda: self.store(version, key, now, render))
+
+    def store(self, version, key, now, render):
+        """Compute a value and cache it"""
+        output = render()
+        if version != self.version:
+            self.version = version
+            self.entries = {}
+        self.entries[key] = (now, output)
+        return output
+
+    def get_metrics(self):
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.flights.coalesced}
+
+
+class FragmentCache:
+    """Cache of rendered HTML fragments of the index page
+
+    The order form only depends on the menu, so it is keyed by the menu version.
+    Each order card is keyed by (order id, order version) and only rendered again
+    when the order is updated.
+    """
+
+    def __init__(self):
+        self.form = None
+        self.cards = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_form(self, menu_version, render):
+        """Get the rendered order form, rendering it if the menu changed"""
+        form = self.form
+        if form is not None and form[0] == menu_version:
+            self.hits += 1
+            return form[1]
+
+        self.misses += 1
+        html = render()
+        self.form = (menu_version, html)
+        return html
+
+    def get_cards(self, orders, render):
+        """Get the rendered card of each order, rendering only the changed ones"""
+        return list(self.iter_cards(orders, render))
+
+    def iter_cards(self, orders, render):
+        """Yield the rendered card of each order as `orders` yields them"""
+        cached = self.cards
+        cards = {}
+        for order in orders:
+            key = (order.id, order.version)
+            html = cached.get(key)
+            if html is None:
+                self.misses += 1
+                html = render(order)
+            else:
+                self.hits += 1
+            cards[key] = html
+            yield html
+
+        # Only keep the cards of the current window, deleted and expired orders are dropped
+        self.cards = cards
+
+
+class AdmissionController:
+    """Admission control for the write endpoints
+
+    Each client gets a token bucket refilled at `rate` tokens per second, a request
+    without a token is refused with a 429, a `rate` of 0 disables it. The number of writes running at the same
+    time is bounded by a semaphore, a request that can't get a slot within `timeout`
+    seconds is refused with a 503. Both answers carry a Retry-After header, and reads
+    never wait behind a write storm for a worker thread.
+    """
+
+    MAX_CLIENTS = 10000
+
+    def __init__(self, rate, burst, max_concurrent, timeout):
+        if rate < 0:
+            raise ValueError(f"The write rate must be positive, or 0 for no limit: {rate}")
+        if rate and burst < 1:
+            raise ValueError(f"The write burst must allow at least one request: {burst}")
+        if max_concurrent < 1:
+            raise ValueError(f"At least one concurrent write must be allowed: {max_concurrent}")
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.metrics = {
+            'admitted': 0,
+            'rate_limited': 0,
+            'overloaded': 0,
+            'in_flight': 0,
+            'max_in_flight': 0,
+            'max_concurrent': max_concurrent,
+        }
+
+    def take_token(self, client):
+        """Take a token from the bucket of a client, return the seconds to wait if there is none"""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[client] = (tokens, now)
+                return (1 - tokens) / self.rate
+
+            # Forget the clients whose bucket is full again, they behave like new ones
+            if client not in self.buckets and len(self.buckets) >= self.MAX_CLIENTS:
+                self.buckets = {c: (t, l) for c, (t, l) in self.buckets.items()
+                                if t + (now - l) * self.rate < self.burst}
+
+            self.buckets[client] = (tokens - 1, now)
+            return 0
+
+    def refuse(self, status, retry_after, reason):
+        """Build a fast refusal response"""
+        with self.lock:
+            self.metrics[reason] += 1
+        response = Response(f"Too many requests, please retry in {retry_after} seconds.\n",
+                            status=status, mimetype="text/plain")
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def admit(self, view, *args, **kwargs):
+        """Run a write view if the request is admitted, or refuse it"""
+        wait = self.take_token(request.remote_addr)
+        if wait:
+            return self.refuse(429, math.ceil(wait), 'rate_limited')
+
+        if not self.slots.acquire(timeout=self.timeout):
+            return self.refuse(503, 1, 'overloaded')
+
+        with self.lock:
+            self.metrics['admitted'] += 1
+            self.metrics['in_flight'] += 1
+            self.metrics['max_in_flight'] = max(self.metrics['max_in_flight'], self.metrics['in_flight'])
+        try:
+            return view(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.metrics['in_flight'] -= 1
+            self.slots.release()
+
+    def get_metrics(self):
+        """Get a snapshot of the admission metrics"""
+        with self.lock:
+            return dict(self.metrics, clients=len(self.buckets))
+
+
+def write_admission_controlled(view):
+    """Decorator applying the admission control of the application to a write endpoint"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return get_state().write_admission.admit(view, *args, **kwargs)
+    return wrapper
+
+
+def admin_required(view):
+    """Decorator restricting an endpoint to callers sending the admin token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        admin_token = current_app.config['ADMIN_TOKEN']
+        if not admin_token:
+            abort(404)
+        token = request.headers.get('X-Admin-Token') or request.args.get('token', '')
+        if not hmac.compare_digest(token, admin_token):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RequestProfiler:
+    """Sampled cProfile capture of requests, aggregated per endpoint
+
+    The request hooks are only installed when the sample rate is above 0, so a
+    disabled profiler costs nothing.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.profiled = {}
+
+    def install(self, flask_app):
+        """Install the request hooks profiling the sampled requests"""
+        if self.sample_rate <= 0:
+            return
+        flask_app.before_request(self.start)
+        flask_app.teardown_request(self.stop)
+
+    def start(self):
+        if random.random() < self.sample_rate:
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    def stop(self, exc=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+
+        endpoint = request.endpoint or request.path
+        with self.lock:
+            if endpoint in self.stats:
+                self.stats[endpoint].add(profile)
+            else:
+                self.stats[endpoint] = pstats.Stats(profile)
+            self.profiled[endpoint] = self.profiled.get(endpoint, 0) + 1
+
+    def report(self, endpoint=None, sort='cumulative', limit=40):
+        """Get the aggregated profile of the sampled requests as text"""
+        out = io.StringIO()
+        with self.lock:
+            for name, stats in self.stats.items():
+                if endpoint and name != endpoint:
+                    continue
+                out.write(f"==== {name} ({self.profiled[name]} requests profiled)\n")
+                stats.stream = out
+                stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue() or "No request profiled yet.\n"
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.profiled.clear()
+
+
+class ChangeNotifier:
+    """Lets requests wait until the order data version passes a known version
+
+    Writes made through this worker wake the waiters right away. Writes made by
+    other workers are noticed by reading the version from the storage, at most once
+    every `check_interval` seconds whatever the number of waiting requests.
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self.condition = threading.Condition()
+        self.version = 0
+        self.checked_at = None
+
+    def notify(self):
+        """Wake the waiters up so they check the version again"""
+        with self.condition:
+            self.checked_at = None
+            self.condition.notify_all()
+
+    def wait(self, after, timeout, get_version):
+        """Wait until the version differs from `after` or the timeout expires, return the version"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.checked_at is None or now - self.checked_at >= self.check_interval:
+                    self.version = get_version()
+                    self.checked_at = now
+
+                if self.version != after or now >= deadline:
+                    return self.version
+
+                self.condition.wait(min(deadline, self.checked_at + self.check_interval) - now)
+
+
+class CronSchedule:
+    """Cron expression with the fields: minute hour day-of-month month day-of-week
+
+    Each field accepts *, numbers, ranges a-b, lists a,b and steps */n or a-b/n.
+    Day of week 0 is Sunday. Unlike cron, a restricted day of month and day of
+    week must both match.
+    """
+
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(self.FIELD_RANGES):
+            raise ValueError(f"Invalid cron expression: {expression}")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self.parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES))
+
+    @staticmethod
+    def parse_field(field, low, high):
+        """Get the set of values matched by a cron field"""
+        values = set()
+        for part in field.split(','):
+            part, _, step = part.partition('/')
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+            else:
+                start = int(part)
+                end = high if step else start
+            if not low <= start <= end <= high:
+                raise ValueError(f"Invalid cron field: {field}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return frozenset(values)
+
+    def next_after(self, moment):
+        """Get the first matching minute after `moment`"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=5 * 366)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif moment.day not in self.days or (moment.weekday() + 1) % 7 not in self.weekdays:
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError("The cron expression never matches")
+
+
+class ScheduledJob:
+    """A periodic job of the Scheduler, run every `interval` seconds or on a cron schedule"""
+
+    def __init__(self, name, func, interval=None, cron=None, jitter=0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.running = False
+        self.next_run = None
+        self.metrics = {
+            'runs': 0,
+            'failures': 0,
+            'skipped_overruns': 0,
+            'last_seconds': None,
+            'max_seconds': 0.0,
+            'total_seconds': 0.0,
+            'last_run': None,
+            'next_run': None,
+        }
+
+    def schedule_next(self, now):
+        """Compute the time of the next run after `now`, with a random jitter"""
+        if self.cron is not None:
+            next_run = self.cron.next_after(datetime.fromtimestamp(now)).timestamp()
+        else:
+            next_run = now + self.interval
+        self.next_run = next_run + random.uniform(0, self.jitter)
+        self.metrics['next_run'] = datetime.fromtimestamp(self.next_run).strftime(TIMESTAMP_FORMAT)
+
+
+class Scheduler:
+    """Runs periodic maintenance jobs in a single worker
+
+    The workers sharing a database elect the one running the jobs by taking an
+    exclusive lock on `lock_path`, the others retry every `election_interval`
+    seconds in case it stops. Each run gets its own thread, and a job still running
+    when its next run is due skips that run rather than piling up.
+    """
+
+    def __init__(self, app, lock_path=None, election_interval=30):
+        self.app = app
+        self.lock_path = lock_path
+        self.election_interval = election_interval
+        self.lock_file = None
+        self.leader = False
+        self.jobs = []
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    def add_job(self, name, func, interval=None, cron=None, jitter=0):
+        """Add a job run every `interval` seconds or on a `cron` schedule"""
+        self.jobs.append(ScheduledJob(name, func, interval=interval, cron=cron, jitter=jitter))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def try_lock(self):
+        """Try to become the worker running the jobs"""
+        if self.lock_path is None or fcntl is None:
+            return True
+
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        # Keep the file open, closing it would release the lock
+        self.lock_file = lock_file
+        return True
+
+    def run(self):
+        while not self.stopped:
+            if not self.leader:
+                self.leader = self.try_lock()
+                if not self.leader:
+                    self.wakeup.wait(self.election_interval)
+                    continue
+                now = time.time()
+                for job in self.jobs:
+                    job.schedule_next(now)
+
+            now = time.time()
+            for job in self.jobs:
+                if now < job.next_run:
+                    continue
+                if job.running:
+                    job.metrics['skipped_overruns'] += 1
+                else:
+                    job.running = True
+                    threading.Thread(target=self.run_job, args=(job,), name=f'job-{job.name}', daemon=True).start()
+                job.schedule_next(now)
+
+            next_run = min((job.next_run for job in self.jobs), default=now + self.election_interval)
+            self.wakeup.wait(max(next_run - time.time(), 0))
+
+    def run_job(self, job):
+        """Run a job in the application context and record its timing"""
+        start = time.perf_counter()
+        try:
+            with self.app.app_context():
+                job.func()
+        except Exception:
+            job.metrics['failures'] += 1
+            self.app.logger.exception("Scheduled job %s failed", job.name)
+        finally:
+            duration = time.perf_counter() - start
+            job.metrics['runs'] += 1
+            job.metrics['last_seconds'] = duration
+            job.metrics['max_seconds'] = max(job.metrics['max_seconds'], duration)
+            job.metrics['total_seconds'] += duration
+            job.metrics['last_run'] = datetime.now().strftime(TIMESTAMP_FORMAT)
+            job.running = False
+
+    def get_metrics(self):
+        """Get the metrics of the scheduler and of each job"""
+        return {
+            'leader': self.leader,
+            'jobs': {job.name: dict(job.metrics, running=job.running) for job in self.jobs},
+        }
+
+
+class AppState:
+    """State of an application, the storage is only created when first needed"""
+
+    def __init__(self, app):
+        self.app = app
+        self.config = config = app.config
+        self.lock = threading.Lock()
+        self.storage = None
+        self.scheduler = None
+        self.fragment_cache = FragmentCache()
+        self.write_admission = AdmissionController(config['WRITE_RATE'], config['WRITE_BURST'],
+                                                   config['MAX_CONCURRENT_WRITES'],
+                                                   config['WRITE_ADMISSION_TIMEOUT'])
+        self.request_profiler = RequestProfiler(config['PROFILE_SAMPLE_RATE'])
+        self.change_notifier = ChangeNotifier(config['LONG_POLL_CHECK_INTERVAL'])
+        self.summary_cache = VersionedCache(config['SUMMARY_CACHE_MAX_AGE'])
+        self.recent_orders_cache = VersionedCache(config['RECENT_ORDERS_CACHE_MAX_AGE'])
+        self.backup = None
+        self.history = None
+        if config['STORAGE'] in ('sqlite', 'event'):
+            self.backup = OnlineBackup(config['DB_PATH'], config['BACKUP_DIR'], config['BACKUP_KEEP'],
+                                       config['BACKUP_PAGES_PER_STEP'], config['BACKUP_STEP_SLEEP'])
+            self.history = ColumnarHistory(config['HISTORY_DIR'], MENU_CATEGORIES)
+
+        # Last tracemalloc snapshot, the next one is compared against it
+        self.memory_snapshot = None
+
+        # Progress of the warm-up, the app is ready right away without one
+        self.ready = not config['WARM_UP']
+        self.warm_up = {'steps': {}, 'seconds': None, 'error': None, 'attempts': 0}
+
+    def get_storage(self):
+        """Get the order storage, creating it and its schema on first use"""
+        if self.storage is None:
+            with self.lock:
+                if self.storage is None:
+                    self.storage = create_storage(self.config)
+                    if self.config['SCHEDULER']:
+                        self.start_scheduler()
+        return self.storage
+
+    def start_scheduler(self):
+        """Start the scheduler of the maintenance jobs"""
+        lock_path = None
+        if self.config['STORAGE'] == 'sqlite':
+            # Only one of the workers sharing the database runs the jobs
+            db_dir = os.path.dirname(os.path.abspath(self.config['DB_PATH']))
+            lock_path = os.path.join(db_dir, '.kos-scheduler.lock')
+
+        self.scheduler = Scheduler(self.app, lock_path)
+        add_maintenance_jobs(self.scheduler, self.config)
+        self.scheduler.start()
+
+
+def get_state():
+    """Get the state of the current application"""
+    return current_app.extensions['kos']
+
+
+def get_storage():
+    """Get the order storage of the current application"""
+    return get_state().get_storage()
+
+
+def add_maintenance_jobs(scheduler, config):
+    """Add the periodic maintenance jobs to a scheduler"""
+    scheduler.add_job('compact_events', compact_events_job, cron=config['EVENT_COMPACTION_CRON'], jitter=60)
+    if config['JOURNAL_MODE'] == 'wal' and config['STORAGE'] in ('sqlite', 'event'):
+        scheduler.add_job('checkpoint', checkpoint_job, interval=config['CHECKPOINT_INTERVAL'], jitter=10)
+    if config['BACKUP_CRON'] and config['STORAGE'] == 'sqlite':
+        scheduler.add_job('backup', backup_job, cron=config['BACKUP_CRON'])
+    if numpy is not None and config['HISTORY_EXPORT_INTERVAL'] and config['STORAGE'] in ('sqlite', 'event'):
+        scheduler.add_job('export_history', export_history_job, interval=config['HISTORY_EXPORT_INTERVAL'], jitter=60)
+
+
+def compact_events_job():
+    """Remove the order events older than the retention period"""
+    hours = current_app.config['EVENT_RETENTION_HOURS']
+    get_storage().compact_events((datetime.now() - timedelta(hours=hours)).strftime(TIMESTAMP_FORMAT))
+
+
+def checkpoint_job():
+    """Checkpoint the journal of the storage"""
+    get_storage().checkpoint()
+
+
+def warm_up(app):
+    """Prepare a new worker for its first requests, then mark it as ready
+
+    A failure, like the storage being locked while the worker boots, is retried with an
+    exponential backoff. The worker stays unready meanwhile and the last error is reported.
+    """
+    state = app.extensions['kos']
+
+    def render_cards():
+        orders = get_recent_orders()
+        state.fragment_cache.get_cards(orders, get_template_attribute('index.html', 'order_card'))
+        state.fragment_cache.get_form(
+            MENU_VERSION,
+            lambda: get_template_attribute('index.html', 'order_form')(
+                kebab_types, meat_options, sauce_options, vegetable_options))
+
+    steps = [
+        ('storage', get_storage),
+        ('pages', lambda: get_storage().warm_up()),
+        ('templates', lambda: [app.jinja_env.get_template(name) for name in ('index.html', 'spinning_wheel.html')]),
+        ('window', render_cards),
+        ('summary', lambda: get_summary('phone', 'standard')),
+    ]
+
+    start = time.perf_counter()
+    delay = app.config['WARM_UP_RETRY_DELAY']
+    while True:
+        state.warm_up['attempts'] += 1
+        try:
+            with app.app_context():
+                for name, step in steps:
+                    step_start = time.perf_counter()
+                    step()
+                    state.warm_up['steps'][name] = time.perf_counter() - step_start
+            break
+        except Exception as e:
+            # Stay unready, the load balancer keeps sending the requests to the other workers
+            state.warm_up['error'] = repr(e)
+            app.logger.exception("Warm-up failed, trying again in %.1f seconds", delay)
+        time.sleep(delay)
+        delay = min(delay * 2, app.config['WARM_UP_MAX_RETRY_DELAY'])
+
+    state.warm_up['seconds'] = time.perf_counter() - start
+    state.ready = True
+
+
+def backup_job():
+    """Write a snapshot of the database"""
+    get_state().backup.run()
+
+
+def export_history_job():
+    """Write a columnar export of the order history for the statistics"""
+    get_state().history.export(current_app.config['DB_PATH'])
+
+
+def orders_changed():
+    """Signal that the orders were modified, called once after each write"""
+    get_state().change_notifier.notify()
+
+
+def sample_stacks(seconds, interval):
+    """Sample the stacks of all the other threads, return them as collapsed stacks
+
+    Each line is the `;` separated frames of a stack from the outermost one, followed
+    by the number of samples, the format expected by flamegraph tools.
+    """
+    counts = {}
+    current = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == current:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+@bp.route('/admin/profile/requests')
+@admin_required
+def profile_requests():
+    """Show the aggregated profile of the sampled requests"""
+    if request.args.get('reset'):
+        get_state().request_profiler.reset()
+        return Response("Request profiles cleared.\n", mimetype="text/plain")
+
+    report = get_state().request_profiler.report(request.args.get('endpoint'),
+                                                 request.args.get('sort', 'cumulative'),
+                                                 request.args.get('limit', 40, type=int))
+    return Response(report, mimetype="text/plain")
+
+
+@bp.route('/admin/slow_queries')
+@admin_required
+def slow_queries():
+    """Show the slow statements of the SQLite storage with their query plans"""
+    slow_query_log = getattr(get_storage(), 'slow_queries', None)
+    if slow_query_log is None:
+        abort(400, "The slow query log needs the sqlite storage")
+
+    if request.args.get('reset'):
+        slow_query_log.reset()
+        return Response("Slow queries cleared.\n", mimetype="text/plain")
+
+    return jsonify({**slow_query_log.get_metrics(), 'queries': slow_query_log.report()})
+
+
+@bp.route('/admin/profile/memory', methods=['GET', 'POST'])
+@admin_required
+def profile_memory():
+    """Take a tracemalloc snapshot and compare it with the previous one
+
+    The first call starts tracing, POST with action=stop stops it.
+    """
+    state = get_state()
+
+    if request.values.get('action') == 'stop':
+        tracemalloc.stop()
+        state.memory_snapshot = None
+        return Response("Memory tracing stopped.\n", mimetype="text/plain")
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(request.args.get('frames', 1, type=int))
+        state.memory_snapshot = tracemalloc.take_snapshot()
+        return Response("Memory tracing started, call again to see the allocations.\n", mimetype="text/plain")
+
+    limit = request.args.get('limit', 25, type=int)
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
 
+    lines = [f"Traced memory: current {current} B, peak {peak} B", "", "Top allocations:"]
+    lines += [str(stat) for stat in snapshot.statistics('lineno')[:limit]]
+    if state.memory_snapshot is not None:
+        lines += ["", "Changes since the previous snapshot:"]
+        lines += [str(stat) for stat in snapshot.compare_to(state.memory_snapshot, 'lineno')[:limit]]
+    state.memory_snapshot = snapshot
+
+    return Response('\n'.join(lines) + '\n', mimetype="text/plain")
+
+
+@bp.route('/admin/profile/stacks')
+@admin_required
+def profile_stacks():
+    """Sample the stacks of the worker threads, as collapsed stacks for flamegraphs"""
+    seconds = min(request.args.get('seconds', 5, type=float), 60)
+    interval = max(request.args.get('interval', 0.005, type=float), 0.001)
+    return Response(sample_stacks(seconds, interval), mimetype="text/plain")
+
+
+@bp.route('/')
+def index():
     # Check if we're in edit mode
     edit_order = None
     if 'edit_order_id' in session:
@@ -188,704 +3293,507 @@ def index():
         # Clear the session after retrieving the order
         session.pop('edit_order_id', None)
 
+    return render_index(edit_order)
+
+
+def render_index(edit_order=None, edit_conflict=False):
+    """Render the index page, with the form editing `edit_order` if it is given"""
+    # Assemble the page from cached fragments, only rendering what changed
+    fragment_cache = get_state().fragment_cache
+    order_form_html = fragment_cache.get_form(
+        MENU_VERSION,
+        lambda: get_template_attribute('index.html', 'order_form')(
+            kebab_types, meat_options, sauce_options, vegetable_options))
+    order_card = get_template_attribute('index.html', 'order_card')
+    context = {
+        'vegetable_options': vegetable_options,
+        'order_form_html': order_form_html,
+        'edit_order': edit_order._asdict() if edit_order else None,
+        'edit_conflict': edit_conflict,
+        'max_batch_orders': MAX_BATCH_ORDERS,
+    }
+
+    if current_app.config['STREAM_INDEX']:
+        # Send the head and the form right away, then the cards once the orders are read,
+        # the IDs are complete by the time the template reaches them after the cards. The
+        # orders are read at once, a cursor left open while a slow client reads the page
+        # would block the writers of the database
+        order_ids = []
+
+        def read_orders():
+            for order in get_recent_orders():
+                order_ids.append(order.id)
+                yield order
+
+        return Response(buffer_stream(stream_template('index.html',
+                                                      order_cards=fragment_cache.iter_cards(read_orders(), order_card),
+                                                      order_ids=order_ids,
+                                                      **context)))
+
+    # Get recent orders from the database
+    orders = get_recent_orders()
     return render_template('index.html',
-                           kebab_types=kebab_types,
-                           meat_options=meat_options,
-                           sauce_options=sauce_options,
-                           vegetable_options=vegetable_options,
-                           orders=orders,
-                           edit_order=edit_order)
+                           order_cards=fragment_cache.get_cards(orders, order_card),
+                           order_ids=[order.id for order in orders],
+                           **context)
 
 
-@app.route('/view_text_summary')
-def view_text_summary():
-    # Get recent orders
-    orders = get_recent_orders()
+# Minimum number of characters sent at once by a streamed page
+STREAM_CHUNK_SIZE = 16384
 
-    # Generate the text summary
-    summary = generate_text_summary(orders)
 
-    # Return as plain text for viewing in browser
-    return Response(summary, mimetype="text/plain")
+def buffer_stream(chunks):
+    """Join the small chunks of a template stream, each one would be a separate write"""
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
 
 
-@app.route('/delete/<int:order_id>', methods=['POST'])
+@bp.route('/view_text_summary')
+def view_text_summary():
+    # Get the requested format and sauce names
+    summary_format = request.args.get('format', 'phone')
+    variant = request.args.get('variant', 'standard')
+    if summary_format not in SUMMARY_FORMATS:
+        abort(400, f"Unknown summary format: {summary_format}")
+    if variant not in SUMMARY_VARIANTS:
+        abort(400, f"Unknown summary variant: {variant}")
+    _, mimetype = SUMMARY_FORMATS[summary_format]
+
+    # Return it for viewing in browser
+    return Response(get_summary(summary_format, variant), mimetype=mimetype)
+
+
+def get_summary(summary_format, variant):
+    """Get a summary from the cache, or generate it from the counted identical orders"""
+    render, _ = SUMMARY_FORMATS[summary_format]
+    storage = get_storage()
+    return get_state().summary_cache.get(
+        storage.change_counter(), (summary_format, variant),
+        lambda: render(storage.aggregate(window_start()), variant))
+
+
+@bp.route('/delete/<int:order_id>', methods=['POST'])
+@write_admission_controlled
 def delete_order(order_id):
-    # Connect to database
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
     # Delete the order with the specified ID
-    cursor.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+    get_storage().delete(order_id)
+    orders_changed()
 
-    conn.commit()
-    conn.close()
+    # Redirect back to the main page
+    return redirect(url_for('.index'))
+
+
+@bp.route('/reorder/<int:order_id>', methods=['POST'])
+@write_admission_controlled
+def reorder(order_id):
+    """Place a copy of a past order, live or archived"""
+    if get_storage().reorder(order_id, datetime.now().strftime(TIMESTAMP_FORMAT)) is None:
+        abort(404)
+    orders_changed()
 
     # Redirect back to the main page
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
+
+
+# Maximum number of orders returned by the search and history endpoints
+MAX_HISTORY_ORDERS = 100
+
+
+@bp.route('/api/orders/search')
+def search_orders():
+    """Search the order history by customer name, kebab type, meat and ingredients"""
+    limit = min(request.args.get('limit', 20, type=int), MAX_HISTORY_ORDERS)
+    orders = get_storage().search(request.args.get('q', ''), limit)
+    return jsonify({'orders': [order._asdict() for order in orders]})
+
+
+@bp.route('/api/orders/last')
+def last_orders():
+    """Get the last orders of a customer, to place one of them again"""
+    name = request.args.get('name', '').strip()
+    if not name:
+        abort(400, "Missing customer name")
+
+    limit = min(request.args.get('limit', 5, type=int), MAX_HISTORY_ORDERS)
+    orders = get_storage().last_orders(name, limit)
+    return jsonify({'orders': [order._asdict() for order in orders]})
+
+
+@bp.route('/healthz')
+def healthz():
+    """Liveness probe, the worker answers requests"""
+    return jsonify({'status': 'ok'})
+
+
+@bp.route('/readyz')
+def readyz():
+    """Readiness probe, the worker is warm and can take traffic"""
+    state = get_state()
+    return jsonify({'ready': state.ready, 'warm_up': state.warm_up}), 200 if state.ready else 503
+
+
+@bp.route('/metrics')
+@admin_required
+def metrics():
+    """Show the internal metrics of the server, with the backup paths and storage internals"""
+    state = get_state()
+    return jsonify({
+        'admission': state.write_admission.get_metrics(),
+        'fragment_cache': {'hits': state.fragment_cache.hits, 'misses': state.fragment_cache.misses},
+        'summary_cache': state.summary_cache.get_metrics(),
+        'recent_orders_cache': state.recent_orders_cache.get_metrics(),
+        'storage': state.get_storage().get_metrics(),
+        'scheduler': state.scheduler.get_metrics() if state.scheduler else None,
+        'backup': state.backup.get_metrics() if state.backup else None,
+        'history': state.history.get_metrics() if state.history else None,
+    })
+
+
+def parse_bulk_timestamp(value, end_of_day):
+    """Parse a time range bound of a bulk request, a date alone covers the whole day"""
+    if not value:
+        return None
+    if not isinstance(value, str):
+        abort(400, f"Invalid timestamp: {value}")
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+    except ValueError:
+        pass
+    try:
+        day = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        abort(400, f"Invalid timestamp: {value}")
+    return day.strftime("%Y-%m-%d 23:59:59" if end_of_day else "%Y-%m-%d 00:00:00")
+
+
+def read_order_selection():
+    """Read the orders selected by a bulk request, from a JSON body or form fields
+
+    `ids` is a list of order IDs (comma separated in forms), `since` and `until`
+    bound the order timestamps and `name` selects the orders of one person.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        data = request.form
+        ids = [part for value in data.getlist('ids') for part in value.split(',') if part.strip()]
+    elif isinstance(data, dict):
+        ids = data.get('ids')
+    else:
+        abort(400, "The JSON body must be an object")
+
+    if ids is not None:
+        try:
+            ids = frozenset(int(order_id) for order_id in ids)
+        except (TypeError, ValueError):
+            abort(400, "Invalid order IDs")
+
+    selection = OrderSelection(ids=ids,
+                               since=parse_bulk_timestamp(data.get('since'), end_of_day=False),
+                               until=parse_bulk_timestamp(data.get('until'), end_of_day=True),
+                               name=data.get('name') or None)
+    if selection.name is not None and not isinstance(selection.name, str):
+        abort(400, "Invalid name")
+    if selection.is_empty():
+        abort(400, "Select the orders by ids, since/until or name")
+    return selection
+
+
+def bulk_response(count):
+    """Answer a bulk request with JSON for scripts, or go back to the main page for forms"""
+    # A single change for all the orders, instead of one per order
+    orders_changed()
+
+    if request.is_json:
+        return jsonify({'count': count})
+    return redirect(url_for('.index'))
+
+
+@bp.route('/orders/bulk/delete', methods=['POST'])
+@write_admission_controlled
+def bulk_delete_orders():
+    """Delete the selected orders in one transaction"""
+    return bulk_response(get_storage().bulk_delete(read_order_selection()))
+
+
+@bp.route('/orders/bulk/archive', methods=['POST'])
+@write_admission_controlled
+def bulk_archive_orders():
+    """Move the selected orders to the archive in one transaction, closing a round"""
+    return bulk_response(get_storage().bulk_archive(read_order_selection()))
+
+
+@bp.route('/orders/bulk/duplicate', methods=['POST'])
+@write_admission_controlled
+def bulk_duplicate_orders():
+    """Place the selected orders again, like "same as last Friday", in one transaction"""
+    timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+    return bulk_response(get_storage().bulk_duplicate(read_order_selection(), timestamp))
+
+
+@bp.route('/api/changes')
+def changes():
+    """Get the changes made to the orders after the `after` cursor
+
+    When the cursor is older than the compacted part of the log, or newer than the
+    log itself, `reset` tells the client to reload all the orders and continue from
+    the `next` cursor.
+    """
+    after = request.args.get('after', 0, type=int)
+    return changes_response(after, min(request.args.get('limit', 500, type=int), 1000))
+
+
+@bp.route('/api/changes/wait')
+def wait_for_changes():
+    """Long-poll for the changes made to the orders after the `after` cursor
+
+    The request waits until the order data version passes the cursor or the
+    `timeout` expires, then answers like /api/changes. Clients that can't keep a
+    stream open get the changes as soon as they happen without polling in a loop.
+    """
+    after = request.args.get('after', 0, type=int)
+    timeout = request.args.get('timeout', 25, type=float)
+    timeout = min(max(timeout, 0), current_app.config['LONG_POLL_MAX_TIMEOUT'])
+
+    storage = get_storage()
+    get_state().change_notifier.wait(after, timeout, storage.latest_seq)
+
+    return changes_response(after, min(request.args.get('limit', 500, type=int), 1000))
+
+
+def changes_response(after, limit):
+    """Build the answer of the change endpoints"""
+    events, latest, horizon = get_storage().changes_since(after, limit)
+
+    if after < horizon or after > latest:
+        return jsonify({'events': [], 'next': latest, 'reset': True, 'more': False})
+
+    return jsonify({
+        'events': [dict(event, order=event['order']._asdict() if event['order'] else None) for event in events],
+        'next': events[-1]['seq'] if events else after,
+        'reset': False,
+        'more': len(events) == limit,
+    })
+
+
+@bp.route('/admin/backup', methods=['POST'])
+@admin_required
+def backup():
+    """Write a snapshot of the database without stopping the writes"""
+    online_backup = get_state().backup
+    if online_backup is None:
+        abort(400, "Backups need the sqlite storage")
+
+    try:
+        return jsonify(online_backup.run())
+    except RuntimeError as e:
+        abort(409, str(e))
+    except sqlite3.DatabaseError as e:
+        abort(500, str(e))
 
 
-@app.route('/edit/<int:order_id>', methods=['POST'])
+@bp.route('/admin/events/compact', methods=['POST'])
+@admin_required
+def compact_events():
+    """Remove the order events older than the retention period"""
+    hours = request.values.get('hours', current_app.config['EVENT_RETENTION_HOURS'], type=float)
+    before = (datetime.now() - timedelta(hours=hours)).strftime(TIMESTAMP_FORMAT)
+    return jsonify({'deleted': get_storage().compact_events(before)})
+
+
+@bp.route('/edit/<int:order_id>', methods=['POST'])
 def edit_order(order_id):
     # Store the order ID in session for retrieval on the main page
     session['edit_order_id'] = order_id
 
     # Redirect back to the main page with the edit_order_id in the session
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 
-@app.route('/order', methods=['POST'])
+@bp.route('/order', methods=['POST'])
+@write_admission_controlled
 def place_order():
     if request.method == 'POST':
-        name = request.form.get('name', 'Anonymous')
-        kebab_type = request.form.get('kebab_type')
-        meat = request.form.get('meat')
-        sauces = request.form.getlist('sauces')  # Gets multiple selected values
-
-        # Get veggie option
-        veggie_option = request.form.get('veggie_option', 'nature')
-
-        # Process vegetables
-        if veggie_option == 'nature':
-            vegetables = []
-            is_nature = 1  # SQLite doesn't have a boolean type, use 1 for True
-        elif veggie_option == 'all':
-            # All vegetables selected
-            vegetables = vegetable_options.copy()
-            is_nature = 0
-        else:
-            # Custom vegetables selected
-            is_nature = 0
-            vegetables = request.form.getlist('vegetables')
-
-        # Connect to database
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        # Read and validate the order
+        try:
+            order = read_order_fields(request.form.get, request.form.getlist)
+        except ValueError as e:
+            abort(400, str(e))
 
         # Check if this is an update or a new order
-        order_id = request.form.get('order_id', None)
+        order_id = request.form.get('order_id', None, type=int)
 
+        storage = get_storage()
         if order_id:
-            # Update existing order
-            cursor.execute('''
-            UPDATE orders 
-            SET name = ?, kebab_type = ?, meat = ?, sauces = ?, 
-                is_nature = ?, vegetables = ?
-            WHERE id = ?
-            ''', (
-                name,
-                kebab_type,
-                meat,
-                ','.join(sauces) if sauces else '',
-                is_nature,
-                ','.join(vegetables) if vegetables else '',
-                order_id
-            ))
+            # Update existing order, unless it was changed since the form was filled
+            version = request.form.get('version', None, type=int)
+            if not storage.update(order_id, version=version, **order):
+                return edit_conflict(order_id)
         else:
-            # Insert new order
-            cursor.execute('''
-            INSERT INTO orders (name, kebab_type, meat, sauces, is_nature, vegetables, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                name,
-                kebab_type,
-                meat,
-                ','.join(sauces) if sauces else '',
-                is_nature,
-                ','.join(vegetables) if vegetables else '',
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ))
-
-        conn.commit()
-        conn.close()
+            # Insert new order, a replayed submission with the same client ID is ignored
+            storage.create(timestamp=datetime.now().strftime(TIMESTAMP_FORMAT),
+                           client_id=request.form.get('client_id') or None, **order)
+        orders_changed()
 
         # Redirect back to the main page
-        return redirect(url_for('index'))
-
-
-# Create template directory
-if not os.path.exists('templates'):
-    os.makedirs('templates')
-
-# Write the template file
-with open('templates/index.html', 'w', encoding='utf-8') as f:
-    f.write('''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Kebab Order System</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            margin: 0;
-            padding: 20px;
-            display: flex;
-            flex-direction: column;
-        }
-        h1, h2 {
-            color: #333;
-            text-align: center;
-        }
-        .container {
-            display: flex;
-            flex-wrap: wrap;
-            width: 100%;
-        }
-        .order-form {
-            flex: 1;
-            min-width: 350px;
-            background-color: #f9f9f9;
-            padding: 20px;
-            border-radius: 5px;
-            margin: 0 15px;
-        }
-        .order-list {
-            flex: 1;
-            min-width: 350px;
-            padding: 20px;
-        }
-        label {
-            display: block;
-            margin: 10px 0 5px;
-            font-weight: bold;
-        }
-        input, select {
-            width: 100%;
-            padding: 8px;
-            margin-bottom: 10px;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-            box-sizing: border-box;
-        }
-        button {
-            background-color: #4CAF50;
-            color: white;
-            padding: 10px 15px;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 16px;
-            width: 100%;
-        }
-        button:hover {
-            background-color: #45a049;
-        }
-        .order {
-            background-color: #f9f9f9;
-            padding: 15px;
-            margin-bottom: 15px;
-            border-radius: 5px;
-            border-left: 4px solid #4CAF50;
-            position: relative;
-        }
-        .order p {
-            margin: 5px 0;
-        }
-        .delete-btn {
-            position: absolute;
-            top: 10px;
-            right: 10px;
-            background-color: #f44336;
-            color: white;
-            border: none;
-            border-radius: 50%;
-            width: 30px;
-            height: 30px;
-            text-align: center;
-            cursor: pointer;
-            font-weight: bold;
-            font-size: 16px;
-            padding: 0;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-        .delete-btn:hover {
-            background-color: #d32f2f;
-        }
-        .edit-btn {
-            position: absolute;
-            top: 10px;
-            right: 50px;
-            background-color: #2196F3;
-            color: white;
-            border: none;
-            border-radius: 50%;
-            width: 30px;
-            height: 30px;
-            text-align: center;
-            cursor: pointer;
-            font-weight: bold;
-            font-size: 16px;
-            padding: 0;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-        .edit-btn:hover {
-            background-color: #0b7dda;
-        }
-        .timestamp {
-            color: #888;
-            font-size: 0.8em;
-        }
-        .no-orders {
-            color: #888;
-            font-style: italic;
-        }
-        .sauce-options {
-            display: flex;
-            flex-direction: column;
-        }
-        .sauce-option {
-            margin: 5px 0;
-            display: flex;
-            align-items: center;
-        }
-        .sauce-option input {
-            width: auto;
-            margin-right: 10px;
-        }
-        .sauce-option label {
-            display: inline;
-            margin: 0;
-            font-weight: normal;
-        }
-        .radio-option {
-            margin: 10px 0;
-            display: flex;
-            align-items: center;
-        }
-        .radio-option input {
-            width: auto;
-            margin-right: 10px;
-        }
-        .radio-option label {
-            display: inline;
-            margin: 0;
-            font-weight: bold;
-        }
-        .option-group {
-            background-color: #f5f5f5;
-            padding: 15px;
-            border-radius: 5px;
-            margin: 15px 0;
-        }
-        .group-header {
-            margin-bottom: 10px;
-            font-weight: bold;
-        }
-        .veggie-selections {
-            margin-left: 30px;
-            padding: 10px;
-            background-color: #f0f0f0;
-            border-radius: 5px;
-        }
-        .veggie-checkbox {
-            display: flex;
-            align-items: center;
-            margin: 5px 0;
-        }
-        .veggie-checkbox input {
-            width: auto;
-            margin-right: 10px;
-        }
-        .veggie-checkbox.disabled label {
-            color: #999;
-        }
-        .db-status {
-            text-align: center;
-            margin-top: 20px;
-            color: #666;
-            font-size: 0.9em;
-        }
-        .orders-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        .time-info {
-            font-size: 0.8em;
-            color: #666;
-            font-style: italic;
-        }
-        .form-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 15px;
-        }
-        .cancel-edit {
-            background-color: #f44336;
-            color: white;
-            padding: 5px 10px;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 14px;
-            text-decoration: none;
-            display: inline-block;
-        }
-        .cancel-edit:hover {
-            background-color: #d32f2f;
-        }
-        .hidden {
-            display: none;
-        }
-        .summary-container {
-            background-color: #f5f5f5;
-            padding: 10px;
-            border-radius: 5px;
-            margin-bottom: 15px;
-            border-left: 4px solid #009688;
-            white-space: pre-line;
-            font-family: monospace;
-            font-size: 14px;
-            line-height: 1.2;
-        }
-        .summary-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 5px;
-        }
-        .summary-title {
-            font-weight: bold;
-            color: #009688;
-        }
-        .refresh-btn {
-            background-color: #009688;
-            color: white;
-            padding: 5px 10px;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 12px;
-            text-decoration: none;
-        }
-        .refresh-btn:hover {
-            background-color: #00796B;
-        }
-        @media (max-width: 768px) {
-            .container {
-                flex-direction: column;
-            }
-            .order-form, .order-list {
-                margin: 10px 0;
-            }
-        }
-        .spinning-wheel-link {
-            margin: 15px 0;
-            text-align: center;
-        }
-        .wheel-link-btn {
-            background-color: #ff9800;
-            color: white;
-            padding: 10px 20px;
-            border-radius: 5px;
-            text-decoration: none;
-            display: inline-block;
-            font-weight: bold;
-            transition: background-color 0.3s;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.2);
-        }
-        .wheel-link-btn:hover {
-            background-color: #f57c00;
-            transform: translateY(-2px);
-            box-shadow: 0 4px 8px rgba(0,0,0,0.3);
-        }
-    </style>
-</head>
-<body>
-    <h1>Kebab Order System</h1>
-
-    <div class="container">
-        <div class="order-form">
-            <div class="form-header">
-                <h2 id="formTitle">Place Your Order</h2>
-                <a href="/" id="cancelEdit" class="cancel-edit hidden">Cancel Edit</a>
-            </div>
-
-            <form action="/order" method="post" id="orderForm">
-                <!-- Hidden field for order ID when editing -->
-                <input type="hidden" id="order_id" name="order_id" value="">
-
-                <div>
-                    <label for="name">Your Name:</label>
-                    <input type="text" id="name" name="name" required>
-                </div>
-
-                <div>
-                    <label for="kebab_type">Kebab Type:</label>
-                    <select id="kebab_type" name="kebab_type" required>
-                        <option value="" disabled selected>Select kebab type</option>
-                        {% for type in kebab_types %}
-                        <option value="{{ type }}">{{ type }}</option>
-                        {% endfor %}
-                    </select>
-                </div>
-
-                <div>
-                    <label for="meat">Meat Option:</label>
-                    <select id="meat" name="meat" required>
-                        <option value="" disabled selected>Select meat option</option>
-                        {% for meat in meat_options %}
-                        <option value="{{ meat }}">{{ meat }}</option>
-                        {% endfor %}
-                    </select>
-                </div>
-
-                <div class="option-group">
-                    <div class="group-header">
-                        <span>Vegetable Options:</span>
-                    </div>
-
-                    <div class="radio-option">
-                        <input type="radio" id="nature" name="veggie_option" value="nature" checked onclick="handleVeggieOptions()">
-                        <label for="nature">Nature (no vegetables)</label>
-                    </div>
-
-                    <div class="radio-option">
-                        <input type="radio" id="all_veggies_option" name="veggie_option" value="all" onclick="handleVeggieOptions()">
-                        <label for="all_veggies_option">All vegetables (Salade melee, Carotte, Choux)</label>
-                    </div>
-
-                    <div class="radio-option">
-                        <input type="radio" id="custom_veggies" name="veggie_option" value="custom" onclick="handleVeggieOptions()">
-                        <label for="custom_veggies">Custom vegetable selection:</label>
-                    </div>
-
-                    <div class="veggie-selections" id="veggieSelections">
-                        {% for veggie in vegetable_options %}
-                        <div class="veggie-checkbox">
-                            <input type="checkbox" id="veggie_{{ veggie }}" name="vegetables" value="{{ veggie }}" disabled>
-                            <label for="veggie_{{ veggie }}">{{ veggie }}</label>
-                        </div>
-                        {% endfor %}
-                    </div>
-                </div>
-
-                <div>
-                    <label>Sauces (select multiple):</label>
-                    <div class="sauce-options">
-                        {% for sauce in sauce_options %}
-                        <div class="sauce-option">
-                            <input type="checkbox" id="sauce_{{ sauce }}" name="sauces" value="{{ sauce }}">
-                            <label for="sauce_{{ sauce }}">{{ sauce }}</label>
-                        </div>
-                        {% endfor %}
-                    </div>
-                </div>
-
-                <button type="submit" id="submitButton">Place Order</button>
-            </form>
-        </div>
-
-        <div class="order-list">
-            <div class="orders-header">
-                <h2>Current Orders</h2>
-                <span class="time-info">Showing orders from the past 4 hours</span>
-            </div>
-
-            <div class="summary-container">
-                <div class="summary-header">
-                    <span class="summary-title">Order Summary for Phone:</span>
-                    <a href="#" onclick="refreshSummary(); return false;" class="refresh-btn">Refresh</a>
-                </div>
-                <div id="summaryText">Loading summary...</div>
-            </div>
-            <div class="spinning-wheel-link">
-                <a href="/spinning_wheel" class="wheel-link-btn">
-                    <span style="margin-right: 5px;">🎡</span> Spin the Wheel
-                </a>
-            </div>
-
-            {% if orders %}
-                {% for order in orders %}
-                <div class="order">
-                    <form action="/delete/{{ order.id }}" method="post" onsubmit="return confirm('Are you sure you want to delete this order?');">
-                        <button type="submit" class="delete-btn" title="Delete Order">×</button>
-                    </form>
-
-                    <form action="/edit/{{ order.id }}" method="post">
-                        <button type="submit" class="edit-btn" title="Edit Order">✎</button>
-                    </form>
-
-                    <p><strong>Name:</strong> {{ order.name }}</p>
-                    <p><strong>Kebab Type:</strong> {{ order.kebab_type }}</p>
-                    <p><strong>Meat:</strong> {{ order.meat }}</p>
-                    <p><strong>Sauces:</strong> {{ ', '.join(order.sauces) if order.sauces else 'None' }}</p>
-                    <p><strong>Vegetables:</strong> 
-                        {% if order.is_nature %}
-                            Nature (no vegetables)
-                        {% else %}
-                            {{ ', '.join(order.vegetables) if order.vegetables else 'None selected' }}
-                        {% endif %}
-                    </p>
-                    <p class="timestamp">Ordered at: {{ order.timestamp }}</p>
-                </div>
-                {% endfor %}
-            {% else %}
-                <p class="no-orders">No orders have been placed in the last 4 hours.</p>
-            {% endif %}
-        </div>
-    </div>
-
-    <div class="db-status">
-        <p>Orders are stored in SQLite database: kebab_orders.db</p>
-    </div>
-
-    <script>
-        function handleVeggieOptions() {
-            // Get radio buttons and checkboxes
-            var natureRadio = document.getElementById('nature');
-            var allVeggiesRadio = document.getElementById('all_veggies_option');
-            var customVeggiesRadio = document.getElementById('custom_veggies');
-            var veggieCheckboxes = document.querySelectorAll('input[name="vegetables"]');
-
-            // Enable or disable checkboxes based on selection
-            if (customVeggiesRadio.checked) {
-                // Enable checkboxes for custom selection
-                veggieCheckboxes.forEach(function(checkbox) {
-                    checkbox.disabled = false;
-                });
-            } else {
-                // Disable and uncheck when not using custom selection
-                veggieCheckboxes.forEach(function(checkbox) {
-                    checkbox.disabled = true;
-                    checkbox.checked = false;
-                });
-            }
-        }
-
-        // Function to fill the form with order data for editing
-        function setupEditMode(order) {
-            if (!order) return;
-
-            // Update form title and button text
-            document.getElementById('formTitle').textContent = 'Edit Your Order';
-            document.getElementById('submitButton').textContent = 'Update Order';
-            document.getElementById('cancelEdit').classList.remove('hidden');
-
-            // Fill in the form fields
-            document.getElementById('order_id').value = order.id;
-            document.getElementById('name').value = order.name;
-            document.getElementById('kebab_type').value = order.kebab_type;
-            document.getElementById('meat').value = order.meat;
-
-            // Handle vegetable options
-            if (order.is_nature) {
-                document.getElementById('nature').checked = true;
-            } else if (order.vegetables.length === {{ vegetable_options|length }}) {
-                document.getElementById('all_veggies_option').checked = true;
-            } else {
-                document.getElementById('custom_veggies').checked = true;
-                // Check the appropriate vegetables
-                order.vegetables.forEach(function(veggie) {
-                    const veggieCheckbox = document.getElementById('veggie_' + veggie);
-                    if (veggieCheckbox) {
-                        veggieCheckbox.checked = true;
-                    }
-                });
-            }
-
-            // Handle veggie options after setting the radio buttons
-            handleVeggieOptions();
-
-            // Check the appropriate sauces
-            order.sauces.forEach(function(sauce) {
-                const sauceCheckbox = document.getElementById('sauce_' + sauce);
-                if (sauceCheckbox) {
-                    sauceCheckbox.checked = true;
-                }
-            });
-
-            // Scroll to the top of the form
-            document.querySelector('.order-form').scrollIntoView({behavior: 'smooth'});
-        }
-
-        // Function to fetch and update the text summary
-        function refreshSummary() {
-            fetch('/view_text_summary')
-                .then(response => response.text())
-                .then(text => {
-                    document.getElementById('summaryText').textContent = text;
-                })
-                .catch(error => {
-                    console.error('Error fetching summary:', error);
-                    document.getElementById('summaryText').textContent = 'Error loading summary. Please try again.';
-                });
-        }
-
-        // Konami Code implementation
-        const konamiCode = ['ArrowUp', 'ArrowUp', 'ArrowDown', 'ArrowDown', 'ArrowLeft', 'ArrowRight', 'ArrowLeft', 'ArrowRight', 'b', 'a'];
-        let konamiIndex = 0;
-        let konamiActivated = false;
-
-        document.addEventListener('keydown', function(e) {
-            // Check if the key matches the expected key in the Konami sequence
-            if (e.key === konamiCode[konamiIndex]) {
-                konamiIndex++;
-
-                // If we've reached the end of the sequence
-                if (konamiIndex === konamiCode.length) {
-                    konamiActivated = !konamiActivated;
-                    konamiIndex = 0;
-
-                    // Apply the sauce name changes
-                    updateSauceLabels();
-
-                    // Easter egg notification
-                    alert(konamiActivated ? 'Easter Egg Activated! Sauces renamed.' : 'Easter Egg Deactivated! Sauces restored.');
-                }
-            } else {
-                // Reset if the sequence is broken
-                konamiIndex = 0;
-            }
-        });
-
-        // Function to update sauce labels based on Konami code status
-        function updateSauceLabels() {
-            // Get all sauce labels
-            const sauceLabels = document.querySelectorAll('.sauce-option label');
-            const sauceInputs = document.querySelectorAll('.sauce-option input');
-
-            sauceLabels.forEach((label, index) => {
-                const input = sauceInputs[index];
-                const originalValue = input.value;
-
-                if (originalValue === 'Blanche') {
-                    label.textContent = konamiActivated ? 'Planche' : 'Blanche';
-                    // We don't change the value to maintain database consistency
-                } else if (originalValue === 'Cocktail') {
-                    label.textContent = konamiActivated ? 'Coque-tel' : 'Cocktail';
-                }
-            });
-
-            // Also update the summary to reflect the changes
-            refreshSummary();
-        }
-
-        // Initialize the form when page loads
-        document.addEventListener('DOMContentLoaded', function() {
-            handleVeggieOptions();
-
-            // Load the initial summary
-            refreshSummary();
-
-            // Check if we have an edit order
-            {% if edit_order %}
-                setupEditMode({{ edit_order|tojson }});
-            {% endif %}
-        });
-    </script>
-</body>
-</html>
-    ''')
-
-
-@app.route('/spinning_wheel')
+        return redirect(url_for('.index'))
+
+
+def edit_conflict(order_id):
+    """Answer an update of an order that was changed or deleted by someone else"""
+    current = get_order_by_id(order_id)
+    if current is None:
+        abort(404)
+
+    # Send the current state of the order so the edit can be made again on top of it
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': 'conflict', 'order': current._asdict()}), 409
+    return render_index(current, edit_conflict=True), 409
+
+
+def read_order_fields(get, getlist):
+    """Read the fields of an order with the given getters of a form or JSON object
+
+    Returns the validated order fields, raises ValueError if the order is not on the menu
+    or the name is not text.
+    """
+    name = get('name', 'Anonymous')
+    if not isinstance(name, str):
+        # Only possible in JSON, the storage engines expect a string
+        raise ValueError("The name must be a string")
+    kebab_type = get('kebab_type')
+    meat = get('meat')
+    sauces = getlist('sauces')  # Gets multiple selected values
+
+    # Get veggie option
+    veggie_option = get('veggie_option', 'nature')
+
+    # Process vegetables
+    if veggie_option == 'nature':
+        vegetables = []
+        is_nature = 1  # SQLite doesn't have a boolean type, use 1 for True
+    elif veggie_option == 'all':
+        # All vegetables selected
+        vegetables = vegetable_options.copy()
+        is_nature = 0
+    else:
+        # Custom vegetables selected
+        is_nature = 0
+        vegetables = getlist('vegetables')
+
+    # Reject anything that is not on the menu and put the ingredients in menu order
+    sauces, vegetables = validate_order(kebab_type, meat, sauces, vegetables)
+
+    return {'name': name, 'kebab_type': kebab_type, 'meat': meat, 'sauces': sauces,
+            'is_nature': is_nature, 'vegetables': vegetables}
+
+
+# Maximum number of orders in a batch sent by the offline outbox
+MAX_BATCH_ORDERS = 50
+
+
+@bp.route('/api/orders/batch', methods=['POST'])
+@write_admission_controlled
+def place_order_batch():
+    """Place the orders queued by the offline outbox of the index page, in one transaction
+
+    Each order carries a `client_id` generated by the browser, so a batch replayed
+    after a lost answer doesn't create the orders twice. Every order gets a status:
+    created, duplicate (already stored) or invalid.
+    """
+    data = request.get_json(silent=True) or {}
+    orders = data.get('orders')
+    if not isinstance(orders, list) or len(orders) > MAX_BATCH_ORDERS:
+        abort(400, f"Send a list of at most {MAX_BATCH_ORDERS} orders")
+
+    timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+    results = []
+    valid = []
+    for fields in orders:
+        if not isinstance(fields, dict):
+            fields = {}
+        client_id = fields.get('client_id')
+        if client_id is not None and not isinstance(client_id, str):
+            results.append({'client_id': client_id, 'status': 'invalid', 'error': "The client ID must be a string"})
+            continue
+        try:
+            order = read_order_fields(fields.get, lambda key: fields.get(key) or [])
+        except (ValueError, TypeError) as e:
+            results.append({'client_id': client_id, 'status': 'invalid', 'error': str(e)})
+            continue
+        results.append({'client_id': client_id})
+        valid.append((results[-1], dict(order, timestamp=timestamp, client_id=client_id or None)))
+
+    if valid:
+        created = get_storage().create_many([order for _, order in valid])
+        for (result, _), (order_id, is_new) in zip(valid, created):
+            result.update(id=order_id, status='created' if is_new else 'duplicate')
+        orders_changed()
+
+    return jsonify({'results': results})
+
+
+@bp.route('/api/stats')
+def order_stats():
+    """Count all the live and archived orders by kebab type, meat, ingredient or time period
+
+    Counts come from the latest columnar export of the history when there is one,
+    so orders placed since then are missing, otherwise they are counted with SQL.
+    """
+    group = request.args.get('by', 'meat')
+    if group not in ColumnarHistory.GROUPS:
+        abort(400, f"Invalid group, expected one of: {', '.join(ColumnarHistory.GROUPS)}")
+    since = parse_bulk_timestamp(request.args.get('since'), end_of_day=False)
+    until = parse_bulk_timestamp(request.args.get('until'), end_of_day=True)
+
+    history = get_state().history
+    if history is None:
+        abort(400, "Order statistics need the sqlite or event storage")
+
+    source = 'columnar'
+    counts = history.count_by(group, since, until) if numpy is not None else None
+    if counts is None:
+        source = 'sql'
+        get_storage()  # Creates the schema of a new database
+        conn = sqlite3.connect(current_app.config['DB_PATH'])
+        try:
+            counts = history.count_by_sql(conn, group, since, until)
+        finally:
+            conn.close()
+
+    return jsonify({'by': group, 'since': since, 'until': until, 'source': source, 'counts': counts})
+
+
+@bp.route('/api/menu')
+def menu():
+    """Get the menu, cached by the service worker of the index page"""
+    return jsonify({
+        'version': MENU_VERSION,
+        'kebab_types': kebab_types,
+        'meat_options': meat_options,
+        'sauce_options': sauce_options,
+        'vegetable_options': vegetable_options,
+    })
+
+
+@bp.route('/sw.js')
+def service_worker():
+    """Get the service worker caching the app shell and the menu"""
+    response = Response(render_template('sw.js', menu_version=MENU_VERSION), mimetype="application/javascript")
+    # The browser must always check for a new version of the service worker
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@bp.route('/spinning_wheel')
 def spinning_wheel():
     """Show a spinning wheel to randomly select a customer from orders"""
     # Get recent orders from the database
@@ -894,8 +3802,8 @@ def spinning_wheel():
     # Extract unique customer names
     customer_names = []
     for order in orders:
-        if order['name'] not in customer_names and order['name'] != 'Anonymous':
-            customer_names.append(order['name'])
+        if order.name not in customer_names and order.name != 'Anonymous':
+            customer_names.append(order.name)
 
     # If no names, add a placeholder
     if not customer_names:
@@ -904,491 +3812,268 @@ def spinning_wheel():
     return render_template('spinning_wheel.html', customer_names=customer_names)
 
 
-# Create a new template file for the spinning wheel
-with open('templates/spinning_wheel.html', 'w', encoding='utf-8') as f:
-    f.write('''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Kebab Order - Random Customer Selector</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            margin: 0;
-            padding: 20px;
-            background-color: #f5f5f5;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-        }
-        h1, h2 {
-            color: #333;
-            text-align: center;
-        }
-        .container {
-            width: 100%;
-            max-width: 600px;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            margin-top: 20px;
-        }
-        .wheel-container {
-            position: relative;
-            width: 400px;
-            height: 400px;
-            margin: 20px auto;
-        }
-        .wheel {
-            width: 100%;
-            height: 100%;
-            border-radius: 50%;
-            position: relative;
-            overflow: hidden;
-            box-shadow: 0 0 10px rgba(0,0,0,0.3);
-        }
-        .pointer {
-            position: absolute;
-            top: -10px;
-            left: 50%;
-            transform: translateX(-50%);
-            width: 0;
-            height: 0;
-            border-left: 20px solid transparent;
-            border-right: 20px solid transparent;
-            border-top: 40px solid #d32f2f;
-            z-index: 10;
-        }
-        .spin-button {
-            background-color: #4CAF50;
-            color: white;
-            border: none;
-            padding: 15px 30px;
-            font-size: 18px;
-            cursor: pointer;
-            border-radius: 5px;
-            margin-top: 30px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-            transition: all 0.3s;
-        }
-        .spin-button:hover {
-            background-color: #45a049;
-            transform: translateY(-2px);
-            box-shadow: 0 6px 8px rgba(0,0,0,0.15);
-        }
-        .spin-button:disabled {
-            background-color: #cccccc;
-            cursor: not-allowed;
-            transform: none;
-            box-shadow: none;
-        }
-        .winner-display {
-            margin-top: 30px;
-            padding: 20px;
-            border-radius: 10px;
-            background-color: #fff;
-            box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-            text-align: center;
-            opacity: 0;
-            transition: all 0.5s;
-            transform: scale(0.95);
-            max-width: 500px;
-            width: 100%;
-            border: 3px dashed #FF9800;
-        }
-        .winner-display.show {
-            opacity: 1;
-            transform: scale(1);
-        }
-        .winner-title {
-            font-size: 24px;
-            color: #FF9800;
-            margin-bottom: 10px;
-            font-weight: bold;
-        }
-        .winner-name {
-            font-size: 28px;
-            font-weight: bold;
-            color: #E91E63;
-            margin-bottom: 15px;
-        }
-        .winner-message {
-            font-size: 16px;
-            color: #555;
-            line-height: 1.5;
-            margin-bottom: 15px;
-        }
-        .winner-phone {
-            font-size: 20px;
-            font-weight: bold;
-            color: #673AB7;
-            margin-top: 10px;
-            padding: 5px;
-            border-radius: 5px;
-            background-color: #f3e5f5;
-            display: inline-block;
-        }
-        .winner-emoji {
-            font-size: 30px;
-            margin: 5px;
-        }
-        .confetti {
-            position: fixed;
-            width: 10px;
-            height: 10px;
-            background-color: #f00;
-            pointer-events: none;
-            opacity: 0;
-        }
-        .back-button {
-            background-color: #2196F3;
-            color: white;
-            border: none;
-            padding: 10px 20px;
-            font-size: 16px;
-            cursor: pointer;
-            border-radius: 5px;
-            margin-top: 20px;
-            text-decoration: none;
-            display: inline-block;
-        }
-        .back-button:hover {
-            background-color: #0b7dda;
-        }
-        .subsections-control {
-            margin-top: 15px;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        .subsections-control label {
-            font-weight: bold;
-        }
-        .subsections-control select {
-            padding: 5px;
-            border-radius: 4px;
-            border: 1px solid #ccc;
-        }
-    </style>
-</head>
-<body>
-    <h1>Kebab Order Random Selector</h1>
-
-    <div class="container">
-        <div class="wheel-container">
-            <div class="pointer"></div>
-            <div class="wheel" id="wheel">
-                <!-- Wheel will be created with canvas -->
-            </div>
-        </div>
-
-        <div class="subsections-control">
-            <label for="subsectionsPerUser">Subsections per user:</label>
-            <select id="subsectionsPerUser">
-                <option value="1">1</option>
-                <option value="2">2</option>
-                <option value="3" selected>3</option>
-                <option value="4">4</option>
-                <option value="5">5</option>
-            </select>
-            <button id="updateWheel" style="padding: 5px 10px; background: #666; color: white; border: none; border-radius: 4px; cursor: pointer;">Update Wheel</button>
-        </div>
-
-        <button id="spinButton" class="spin-button">SPIN THE WHEEL</button>
-
-        <div id="winnerDisplay" class="winner-display">
-            <!-- Winner will be displayed here -->
-        </div>
-
-        <a href="/" class="back-button">Back to Orders</a>
-    </div>
-
-    <script>
-        // Customer names from server
-        const customerNames = {{ customer_names|tojson }};
-
-        // Wheel configuration
-        const wheel = document.getElementById('wheel');
-        const spinButton = document.getElementById('spinButton');
-        const winnerDisplay = document.getElementById('winnerDisplay');
-        const subsectionsSelect = document.getElementById('subsectionsPerUser');
-        const updateWheelButton = document.getElementById('updateWheel');
-
-        let isSpinning = false;
-        let subsectionsPerUser = 3; // Default to 3 subsections per user
-        let wheelCanvas; // Reference to canvas
-        let currentRotation = 0; // Current rotation angle in degrees
-
-        // Colors for the wheel sections - one color per user (more professional and vibrant palette)
-        const userColors = [
-            '#3498DB', '#2ECC71', '#9B59B6', '#F1C40F', 
-            '#E74C3C', '#1ABC9C', '#34495E', '#F39C12',
-            '#16A085', '#27AE60', '#8E44AD', '#D35400',
-            '#2980B9', '#C0392B', '#7D3C98', '#2574A9'
-        ];
-
-        // Generate wheel sections with canvas
-        function generateWheel() {
-            wheel.innerHTML = '';
-
-            const numUsers = customerNames.length;
-            const totalSegments = numUsers * subsectionsPerUser;
-            const anglePerSegment = (2 * Math.PI) / totalSegments;
-            const radius = 200; // Radius of the wheel (400px/2)
-
-            // Create canvas for the wheel
-            wheelCanvas = document.createElement('canvas');
-            wheelCanvas.width = 400;
-            wheelCanvas.height = 400;
-            wheel.appendChild(wheelCanvas);
-
-            // Apply current rotation
-            wheel.style.transform = `rotate(${currentRotation}deg)`;
-
-            const ctx = wheelCanvas.getContext('2d');
-            const centerX = wheelCanvas.width / 2;
-            const centerY = wheelCanvas.height / 2;
-
-            // For each user, create their subsections
-            for (let userIndex = 0; userIndex < numUsers; userIndex++) {
-                const userName = customerNames[userIndex];
-                const userColor = userColors[userIndex % userColors.length];
-
-                // Create subsections for this user
-                for (let subIndex = 0; subIndex < subsectionsPerUser; subIndex++) {
-                    // Calculate the segment index in the wheel
-                    // We want to distribute user subsections evenly around the wheel
-                    // instead of grouping them together
-                    const segmentIndex = (subIndex * numUsers) + userIndex;
-                    const startAngle = segmentIndex * anglePerSegment;
-                    const endAngle = startAngle + anglePerSegment;
-
-                    // Draw pie segment
-                    ctx.beginPath();
-                    ctx.moveTo(centerX, centerY);
-                    ctx.arc(centerX, centerY, radius, startAngle, endAngle);
-                    ctx.closePath();
-
-                    // Fill with user's color (same for all subsections)
-                    ctx.fillStyle = userColor;
-                    ctx.fill();
-
-                    // Add border
-                    ctx.lineWidth = 1.5;
-                    ctx.strokeStyle = 'rgba(255, 255, 255, 0.7)';
-                    ctx.stroke();
-
-                    // Add name label to EVERY subsection
-                    const middleAngle = startAngle + (anglePerSegment / 2);
-                    const labelDistance = radius * 0.7; // Place text at 70% of radius
-
-                    const labelX = centerX + Math.cos(middleAngle) * labelDistance;
-                    const labelY = centerY + Math.sin(middleAngle) * labelDistance;
-
-                    // Save context state
-                    ctx.save();
-
-                    // Position and rotate text
-                    ctx.translate(labelX, labelY);
-                    ctx.rotate(middleAngle + Math.PI/2);
-
-                    // Draw text
-                    ctx.textAlign = 'center';
-                    ctx.fillStyle = '#333';
-                    ctx.font = 'bold 12px Arial';
-
-                    // Add a white text shadow for better readability
-                    ctx.shadowColor = 'white';
-                    ctx.shadowBlur = 3;
-                    ctx.shadowOffsetX = 0;
-                    ctx.shadowOffsetY = 0;
-
-                    // Make sure text fits in the segment
-                    const maxTextWidth = radius * 0.4;
-                    ctx.fillText(userName, 0, 0, maxTextWidth);
-
-                    // Restore context
-                    ctx.restore();
-                }
-            }
-        }
-
-        // Animate the wheel using requestAnimationFrame for smoother performance
-        function animateWheel(startTime, duration, startAngle, targetAngle) {
-            const now = performance.now();
-            const elapsed = now - startTime;
-            const progress = Math.min(elapsed / duration, 1);
-
-            // Easing function - slow down towards the end
-            const easeOut = function(t) {
-                return 1 - Math.pow(1 - t, 3);
-            };
-
-            // Calculate current angle
-            const easedProgress = easeOut(progress);
-            const currentAngle = startAngle + (targetAngle - startAngle) * easedProgress;
-
-            // Apply rotation
-            wheel.style.transform = `rotate(${currentAngle}deg)`;
-
-            // Continue animation if not complete
-            if (progress < 1) {
-                requestAnimationFrame(() => animateWheel(startTime, duration, startAngle, targetAngle));
-            } else {
-                // Animation complete
-                currentRotation = currentAngle % 360; // Store the current rotation (0-359)
-
-                // Calculate which user will be the winner
-                const numUsers = customerNames.length;
-                const totalSegments = numUsers * subsectionsPerUser;
-                const degreesPerSegment = 360 / totalSegments;
-
-                // The wheel rotates clockwise, but the actual position is counterclockwise from the starting point
-                const finalPosition = currentRotation;
-
-                // The pointer is at top (0 degrees), so we need to determine which segment that points to
-                // Since the wheel rotates clockwise, we need to convert to the correct index
-                const segmentIndex = Math.floor(((360 - finalPosition) % 360) / degreesPerSegment) % totalSegments;
-
-                // Convert segment index to user index
-                const userIndex = segmentIndex % numUsers;
-
-                // Show winner with fun display
-                const winner = customerNames[userIndex];
-                winnerDisplay.innerHTML = `
-                    <div class="winner-emoji">🎉 🌯 🎊</div>
-                    <div class="winner-title">JACKPOT!</div>
-                    <div class="winner-name">${winner}</div>
-                    <div class="winner-message">Tu dois appeler le meilleur kebab de la région!</div>
-                    <div class="winner-phone">+41 22 341 35 90</div>
-                    <div class="winner-emoji">🍗 🥙 🔥</div>
-                `;
-                winnerDisplay.classList.add('show');
-                createConfetti();
-
-                // Re-enable spin button
-                setTimeout(() => {
-                    isSpinning = false;
-                    spinButton.disabled = false;
-                }, 1000);
-            }
-        }
-
-        // Spin the wheel
-        function spinWheel() {
-            if (isSpinning) return;
-
-            isSpinning = true;
-            spinButton.disabled = true;
-            winnerDisplay.classList.remove('show');
-
-            // Start angle is the current rotation
-            const startAngle = currentRotation;
-
-            // Calculate target angle - at least 5 full rotations + random extra
-            const minRotations = 5;
-            const randomExtraRotations = 2 + Math.random() * 3;
-            const totalRotations = minRotations + randomExtraRotations;
-
-            // Random final position (0-359 degrees)
-            const randomFinalPosition = Math.floor(Math.random() * 360);
-
-            // Calculate the total target angle
-            const targetAngle = startAngle + (totalRotations * 360) + randomFinalPosition;
-
-            // Animation duration between 4 and 7 seconds
-            const duration = 4000 + Math.random() * 3000;
-
-            // Start the animation
-            animateWheel(performance.now(), duration, startAngle, targetAngle);
-        }
-
-        // Create confetti effect
-        function createConfetti() {
-            const confettiColors = ['#f00', '#0f0', '#00f', '#ff0', '#f0f', '#0ff'];
-            const confettiCount = 150;
-
-            for (let i = 0; i < confettiCount; i++) {
-                const confetti = document.createElement('div');
-                confetti.className = 'confetti';
-
-                // Random position
-                const startX = Math.random() * window.innerWidth;
-                const startY = -20;
-
-                // Random color
-                const color = confettiColors[Math.floor(Math.random() * confettiColors.length)];
-
-                // Set styles
-                confetti.style.left = `${startX}px`;
-                confetti.style.top = `${startY}px`;
-                confetti.style.backgroundColor = color;
-                confetti.style.opacity = '1';
-
-                // Randomize size and shape
-                const size = 5 + Math.random() * 10;
-                confetti.style.width = `${size}px`;
-                confetti.style.height = `${size}px`;
-
-                // Occasionally make rectangle confetti
-                if (Math.random() > 0.5) {
-                    confetti.style.width = `${size * 0.5}px`;
-                    confetti.style.height = `${size * 1.5}px`;
-                }
-
-                // Occasionally make round confetti
-                if (Math.random() > 0.7) {
-                    confetti.style.borderRadius = '50%';
-                }
-
-                // Add to body
-                document.body.appendChild(confetti);
-
-                // Animate falling
-                const animationDuration = 2 + Math.random() * 4;
-                const fallDistance = window.innerHeight + 100;
-                const horizontalSwing = (Math.random() - 0.5) * 300;
-
-                confetti.animate([
-                    { transform: 'translate(0px, 0px) rotate(0deg)' },
-                    { transform: `translate(${horizontalSwing}px, ${fallDistance}px) rotate(${Math.random() * 720}deg)` }
-                ], {
-                    duration: animationDuration * 1000,
-                    easing: 'cubic-bezier(0.4, 0.0, 0.2, 1)'
-                });
-
-                // Remove after animation
-                setTimeout(() => {
-                    if (document.body.contains(confetti)) {
-                        document.body.removeChild(confetti);
-                    }
-                }, animationDuration * 1000);
-            }
-        }
-
-        // Initialize
-        document.addEventListener('DOMContentLoaded', function() {
-            // Set default subsections
-            subsectionsSelect.value = subsectionsPerUser.toString();
-
-            // Generate initial wheel
-            generateWheel();
+def create_app(config=None):
+    """Create the Flask application
+
+    `config` overrides any of the DEFAULT_CONFIG settings. Creating an app doesn't
+    touch the disk, the storage and its schema are initialized once on first use,
+    which is right away in the background if WARM_UP is set.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = os.urandom(24)
+
+    state = AppState(app)
+    app.extensions['kos'] = state
+    state.request_profiler.install(app)
+    app.register_blueprint(bp)
+    if app.config['WARM_UP']:
+        threading.Thread(target=warm_up, args=(app,), name='warm-up', daemon=True).start()
+    return app
+
+
+def benchmark_writes(threads, orders, journal_mode):
+    """Time `threads` threads placing `orders` orders each, with a commit per order and with group commit
+
+    Works on temporary databases, returns (mode, seconds, commits) for each mode.
+    """
+    directory = tempfile.mkdtemp(prefix='kos-bench-')
+    try:
+        results = []
+        for mode, write_behind in (('commit per order', False), ('group commit', True)):
+            storage = SQLiteOrderRepository(os.path.join(directory, f'{mode}.db'), write_behind=write_behind,
+                                            journal_mode=journal_mode)
+            timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+
+            def place_orders(thread):
+                for i in range(orders):
+                    storage.create(f'Customer {thread}-{i}', random.choice(kebab_types), random.choice(meat_options),
+                                   random.sample(sauce_options, 1), False, random.sample(vegetable_options, 2),
+                                   timestamp)
+
+            workers = [threading.Thread(target=place_orders, args=(thread,)) for thread in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            seconds = time.perf_counter() - start
+            commits = storage.writer.metrics['commits'] if storage.writer is not None else threads * orders
+            results.append((mode, seconds, commits))
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def benchmark_decode(orders):
+    """Measure the memory and time of decoding `orders` window rows, as Order tuples and as dictionaries
+
+    The dictionaries with the ingredients split into lists were the representation of
+    the orders before Order. Works on a temporary database, returns (representation,
+    bytes per order, seconds) for each representation.
+    """
+    directory = tempfile.mkdtemp(prefix='kos-bench-')
+    try:
+        storage = SQLiteOrderRepository(os.path.join(directory, 'kebab_orders.db'))
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        storage.create_many([
+            dict(name=f'Customer {i}', kebab_type=random.choice(kebab_types), meat=random.choice(meat_options),
+                 sauces=random.sample(sauce_options, random.randint(0, 2)), is_nature=False,
+                 vegetables=random.sample(vegetable_options, random.randint(0, 3)), timestamp=timestamp)
+            for i in range(orders)])
+        rows = storage.query(storage.WINDOW_SQL, ('',))
+
+        def as_dict(row):
+            order = dict(row)
+            order['sauces'] = order['sauces'].split(',') if order['sauces'] else []
+            order['vegetables'] = order['vegetables'].split(',') if order['vegetables'] else []
+            order['is_nature'] = bool(order['is_nature'])
+            return order
+
+        results = []
+        was_tracing = tracemalloc.is_tracing()
+        for representation, decode in (('dict', as_dict), ('Order', decode_order)):
+            start = time.perf_counter()
+            decoded = [decode(row) for row in rows]
+            seconds = time.perf_counter() - start
+            del decoded
+
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            decoded = [decode(row) for row in rows]
+            size = tracemalloc.get_traced_memory()[0] - before
+            if not was_tracing:
+                tracemalloc.stop()
+            del decoded
+            results.append((representation, size / orders, seconds))
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def benchmark_index(orders, runs):
+    """Time the first byte and the whole index page with `orders` recent orders, buffered and streamed
+
+    Serves a temporary database over HTTP, with the order cards rendered again for every
+    request. Returns (mode, median first byte seconds, median page seconds) for each mode.
+    """
+    directory = tempfile.mkdtemp(prefix='kos-bench-')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    try:
+        db_path = os.path.join(directory, 'kebab_orders.db')
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        SQLiteOrderRepository(db_path).create_many([
+            dict(name=f'Customer {i}', kebab_type=random.choice(kebab_types), meat=random.choice(meat_options),
+                 sauces=random.sample(sauce_options, 1), is_nature=False,
+                 vegetables=random.sample(vegetable_options, 2), timestamp=timestamp)
+            for i in range(orders)])
+
+        results = []
+        for mode, stream in (('buffered', False), ('streamed', True)):
+            app = create_app({'DB_PATH': db_path, 'STREAM_INDEX': stream, 'SCHEDULER': False, 'WARM_UP': False})
+            http_server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=http_server.serve_forever, daemon=True).start()
+            first_byte = []
+            page = []
+            try:
+                for _ in range(runs):
+                    app.extensions['kos'].fragment_cache.cards = {}
+                    conn = http.client.HTTPConnection('127.0.0.1', http_server.server_port)
+                    start = time.perf_counter()
+                    conn.request('GET', '/')
+                    response = conn.getresponse()
+                    response.read(1)
+                    first_byte.append(time.perf_counter() - start)
+                    response.read()
+                    page.append(time.perf_counter() - start)
+                    conn.close()
+            finally:
+                http_server.shutdown()
+            results.append((mode, statistics.median(first_byte), statistics.median(page)))
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def benchmark_history(orders, years):
+    """Time the statistics of random orders over `years` years, from a columnar export and with SQL
+
+    Works on a temporary database, returns (group, NumPy seconds, SQL seconds) for each group.
+    """
+    directory = tempfile.mkdtemp(prefix='kos-bench-')
+    try:
+        db_path = os.path.join(directory, 'kebab_orders.db')
+        storage = SQLiteOrderRepository(db_path)
+        start = datetime.now() - timedelta(days=365 * years)
+        conn = storage.connect()
+        conn.executemany('''
+        INSERT INTO orders (name, kebab_type, meat, sauces, is_nature, vegetables, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', ((f'Customer {random.randrange(500)}', random.choice(kebab_types), random.choice(meat_options),
+               encode_ingredients(random.sample(sauce_options, random.randint(0, 2))), is_nature,
+               '' if is_nature else encode_ingredients(random.sample(vegetable_options, random.randint(0, 3))),
+               (start + timedelta(seconds=random.randrange(365 * years * 86400))).strftime(TIMESTAMP_FORMAT))
+              for is_nature in (random.random() < 0.2 for _ in range(orders))))
+        conn.commit()
 
-            // Event listeners
-            spinButton.addEventListener('click', spinWheel);
+        history = ColumnarHistory(os.path.join(directory, 'history'), MENU_CATEGORIES)
+        history.export(db_path)
+        since = (start + timedelta(days=365)).strftime(TIMESTAMP_FORMAT)
+        results = []
+        for group in ColumnarHistory.GROUPS:
+            numpy_start = time.perf_counter()
+            counts = history.count_by(group, since)
+            numpy_seconds = time.perf_counter() - numpy_start
+            sql_start = time.perf_counter()
+            sql_counts = history.count_by_sql(conn, group, since)
+            sql_seconds = time.perf_counter() - sql_start
+            if dict(counts) != dict(sql_counts):
+                raise AssertionError(f"Different counts by {group}: {counts} != {sql_counts}")
+            results.append((group, numpy_seconds, sql_seconds))
+        conn.close()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
 
-            updateWheelButton.addEventListener('click', function() {
-                subsectionsPerUser = parseInt(subsectionsSelect.value);
-                generateWheel();
-            });
-        });
-    </script>
-</body>
-</html>
-    ''')
 
 if __name__ == '__main__':
+    # The commands only need the settings, so no warm-up or scheduler touches the database
+    app = create_app({'WARM_UP': False, 'SCHEDULER': False})
+
+    # python server.py backup: write a snapshot of the database, the server can keep running
+    if sys.argv[1:] == ['backup']:
+        online_backup = app.extensions['kos'].backup
+        if online_backup is None:
+            sys.exit("Backups need the sqlite storage")
+        print(json.dumps(online_backup.run(), indent=2))
+        sys.exit()
+
+    # python server.py check-plans: fail if a hot query reads a whole table, for CI
+    if sys.argv[1:] == ['check-plans']:
+        storage = SQLiteOrderRepository(app.config['DB_PATH'])
+        try:
+            for plan in storage.check_query_plans():
+                print('\n'.join(plan) + '\n')
+        except AssertionError as e:
+            sys.exit(str(e))
+        print("All the hot queries use indexes.")
+        sys.exit()
+
+    # python server.py export-history: write a columnar export of the order history
+    if sys.argv[1:] == ['export-history']:
+        history = app.extensions['kos'].history
+        if numpy is None or history is None:
+            sys.exit("History exports need NumPy and the sqlite storage")
+        print(json.dumps(history.export(app.config['DB_PATH']), indent=2))
+        sys.exit()
+
+    # python server.py bench-writes [threads [orders]]: compare a commit per order with group commit
+    if sys.argv[1:2] == ['bench-writes']:
+        threads, orders = (list(map(int, sys.argv[2:4])) + [8, 50][len(sys.argv[2:4]):])
+        print(f"{threads} threads placing {orders} orders each, journal mode {app.config['JOURNAL_MODE']}")
+        print(f"{'mode':<20}{'seconds':>10}{'orders/s':>10}{'commits':>10}")
+        for mode, seconds, commits in benchmark_writes(threads, orders, app.config['JOURNAL_MODE']):
+            print(f"{mode:<20}{seconds:>10.2f}{threads * orders / seconds:>10.0f}{commits:>10}")
+        sys.exit()
+
+    # python server.py bench-decode [orders]: compare the memory of the Order tuples and of dictionaries
+    if sys.argv[1:2] == ['bench-decode']:
+        orders = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+        print(f"{orders} window rows decoded")
+        print(f"{'representation':<16}{'bytes/order':>12}{'ms':>10}")
+        for representation, bytes_per_order, seconds in benchmark_decode(orders):
+            print(f"{representation:<16}{bytes_per_order:>12.0f}{seconds * 1000:>10.2f}")
+        sys.exit()
+
+    # python server.py bench-index [orders [runs]]: time the index page, buffered and streamed
+    if sys.argv[1:2] == ['bench-index']:
+        orders, runs = (list(map(int, sys.argv[2:4])) + [3000, 20][len(sys.argv[2:4]):])
+        print(f"{orders} recent orders, median of {runs} requests")
+        print(f"{'mode':<12}{'first byte ms':>16}{'page ms':>12}")
+        for mode, first_byte_seconds, page_seconds in benchmark_index(orders, runs):
+            print(f"{mode:<12}{first_byte_seconds * 1000:>16.2f}{page_seconds * 1000:>12.2f}")
+        sys.exit()
+
+    # python server.py bench-history [orders [years]]: compare the statistics of NumPy and SQL
+    if sys.argv[1:2] == ['bench-history']:
+        if numpy is None:
+            sys.exit("The benchmark needs NumPy")
+        orders, years = (list(map(int, sys.argv[2:4])) + [200000, 5][len(sys.argv[2:4]):])
+        print(f"{orders} orders over {years} years, counted after their first year")
+        print(f"{'group':<12}{'NumPy ms':>12}{'SQL ms':>12}{'speedup':>10}")
+        for group, numpy_seconds, sql_seconds in benchmark_history(orders, years):
+            print(f"{group:<12}{numpy_seconds * 1000:>12.2f}{sql_seconds * 1000:>12.2f}"
+                  f"{sql_seconds / numpy_seconds:>9.1f}x")
+        sys.exit()
+
+    # In debug mode this process only runs the reloader, which serves the requests from a child
+    # process. Only the child creates the storage, the event mode log lock is held by one process
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        app = create_app()
+    port = int(os.environ.get('KOS_PORT', '41586'))
     print("Kebab Order System is running!")
-    print("Open http://127.0.0.1:41586/ in your browser")
-    app.run(debug=True, host="0.0.0.0", port=41586)
\ No newline at end of file
+    print(f"Open http://127.0.0.1:{port}/ in your browser")
+    app.run(debug=True, host="0.0.0.0", port=port)
\ No newline at end of file
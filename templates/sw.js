@@ -0,0 +1,91 @@
+// Service worker of the Kebab Order System
+// Caches the app shell and the menu so the index page loads even on a bad connection
+
+const CACHE_NAME = 'kos-shell-{{ menu_version }}';
+const SHELL_URLS = ['/', '/api/menu'];
+
+// Milliseconds the network gets to answer a page load before the cached shell is used
+const NETWORK_TIMEOUT = 2000;
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(SHELL_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', function(event) {
+    // Remove the caches of the previous menu versions
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => key.startsWith('kos-shell-') && key !== CACHE_NAME)
+                    .map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Get a response from the network, storing it in the cache
+function fetchAndCache(request) {
+    return fetch(request).then(function(response) {
+        if (response.ok) {
+            const copy = response.clone();
+            caches.open(CACHE_NAME).then(cache => cache.put(request, copy));
+        }
+        return response;
+    });
+}
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    // Only the GET requests of this site are cached, orders always go to the server
+    if (request.method !== 'GET' || url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (url.pathname === '/api/menu') {
+        // Answer from the cache right away and update it in the background
+        event.respondWith(
+            caches.match(request).then(function(cached) {
+                const network = fetchAndCache(request);
+                return cached || network;
+            })
+        );
+    } else if (request.mode === 'navigate' && url.pathname === '/') {
+        // The page lists the current orders, so use the network unless it is too slow
+        event.respondWith(new Promise(function(resolve, reject) {
+            let settled = false;
+            const fallback = function() {
+                caches.match('/').then(function(cached) {
+                    if (!settled && cached) {
+                        settled = true;
+                        resolve(cached);
+                    }
+                });
+            };
+            const timer = setTimeout(fallback, NETWORK_TIMEOUT);
+
+            fetchAndCache(request)
+                .then(function(response) {
+                    clearTimeout(timer);
+                    if (!settled) {
+                        settled = true;
+                        resolve(response);
+                    }
+                })
+                .catch(function(error) {
+                    clearTimeout(timer);
+                    caches.match('/').then(function(cached) {
+                        if (!settled) {
+                            settled = true;
+                            cached ? resolve(cached) : reject(error);
+                        }
+                    });
+                });
+        }));
+    }
+});
@@ -0,0 +1,33 @@
+"""Endpoints restricted to callers sending the admin token"""
+
+import os
+
+import pytest
+
+import server
+
+ADMIN_ENDPOINTS = ['/metrics', '/admin/slow_queries', '/admin/profile/requests']
+
+
+def make_app(tmp_path, admin_token):
+    return server.create_app({
+        'DB_PATH': os.path.join(str(tmp_path), 'kos.db'),
+        'ADMIN_TOKEN': admin_token,
+        'WARM_UP': False,
+        'SCHEDULER': False,
+        'TESTING': True,
+    })
+
+
+@pytest.mark.parametrize('path', ADMIN_ENDPOINTS)
+def test_admin_endpoints_need_the_token(tmp_path, path):
+    client = make_app(tmp_path, 'secret').test_client()
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert client.get(path, headers={'X-Admin-Token': 'secret'}).status_code == 200
+    assert client.get(path + '?token=secret').status_code == 200
+
+
+@pytest.mark.parametrize('path', ADMIN_ENDPOINTS)
+def test_admin_endpoints_are_disabled_without_a_token(tmp_path, path):
+    assert make_app(tmp_path, None).test_client().get(path).status_code == 404
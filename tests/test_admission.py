@@ -0,0 +1,42 @@
+"""Admission control of the write endpoints"""
+
+import os
+
+import pytest
+
+import server
+
+
+def make_app(tmp_path, **config):
+    return server.create_app(dict({
+        'DB_PATH': os.path.join(str(tmp_path), 'kos.db'),
+        'WARM_UP': False,
+        'SCHEDULER': False,
+        'TESTING': True,
+    }, **config))
+
+
+def delete_codes(app, requests):
+    client = app.test_client()
+    return [client.post('/delete/999').status_code for _ in range(requests)]
+
+
+def test_clients_are_rate_limited(tmp_path):
+    codes = delete_codes(make_app(tmp_path, WRITE_RATE=1, WRITE_BURST=3), 5)
+    assert codes[:3] == [302] * 3
+    assert codes[3:] == [429] * 2
+
+
+def test_zero_rate_disables_the_limit(tmp_path):
+    assert delete_codes(make_app(tmp_path, WRITE_RATE=0, WRITE_BURST=0), 20) == [302] * 20
+
+
+@pytest.mark.parametrize('config', [
+    {'WRITE_RATE': -1},
+    {'WRITE_RATE': 1, 'WRITE_BURST': 0},
+    {'WRITE_RATE': 1, 'WRITE_BURST': 0.5},
+    {'MAX_CONCURRENT_WRITES': 0},
+])
+def test_invalid_settings_are_refused(tmp_path, config):
+    with pytest.raises(ValueError):
+        make_app(tmp_path, **config)
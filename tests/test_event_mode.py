@@ -0,0 +1,86 @@
+"""Snapshots of the event mode storage"""
+
+import os
+import threading
+
+import pytest
+
+import server
+
+GALETTE = ('Galette', 'Poulet', ['Blanche'], False, [])
+TIMESTAMP = '2026-03-01 12:00:00'
+
+
+@pytest.fixture
+def storage(tmp_path):
+    db_path = os.path.join(str(tmp_path), 'kos.db')
+    storage = server.EventModeOrderRepository(db_path, db_path + '-log.jsonl', max_loss=0.01,
+                                              snapshot_interval=3600)
+    yield storage
+    storage.close()
+
+
+def stored_names(storage):
+    return [row['name'] for row in storage.database.query('SELECT name FROM orders ORDER BY id', ())]
+
+
+def test_refused_record_is_quarantined(storage):
+    storage.create('Alice', *GALETTE, TIMESTAMP)
+    # Stored in memory but refused by the NOT NULL constraint of the database
+    storage.create(None, *GALETTE, TIMESTAMP)
+    storage.create('Bob', *GALETTE, TIMESTAMP)
+
+    assert storage.snapshot() == 3
+    assert stored_names(storage) == ['Alice', 'Bob']
+    assert storage.get_metrics()['quarantined'] == 1
+    assert storage.get_metrics()['pending_records'] == 0
+    assert [record['order']['name'] for record in server.AppendLog.read(storage.quarantine_path)] == [None]
+
+    # The next snapshots aren't blocked by it
+    storage.create('Carol', *GALETTE, TIMESTAMP)
+    assert storage.snapshot() == 1
+    assert stored_names(storage) == ['Alice', 'Bob', 'Carol']
+    assert server.AppendLog.read(storage.log_path) == []
+
+
+def test_log_rewrite_doesnt_hold_the_orders_lock(storage, monkeypatch):
+    alice = storage.create('Alice', *GALETTE, TIMESTAMP)
+
+    # Hold the snapshot in the fsync of the rewritten log
+    in_fsync = threading.Event()
+    release = threading.Event()
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        if threading.current_thread().name == 'snapshot':
+            in_fsync.set()
+            release.wait(10)
+        fsync(fd)
+
+    monkeypatch.setattr(server.os, 'fsync', slow_fsync)
+    snapshot = threading.Thread(target=storage.snapshot, name='snapshot')
+    snapshot.start()
+    done = []
+
+    def read_and_write():
+        done.append(storage.get(alice).name)
+        done.append(storage.create('Bob', *GALETTE, TIMESTAMP))
+
+    try:
+        assert in_fsync.wait(10)
+        # Reads and writes go on meanwhile
+        worker = threading.Thread(target=read_and_write)
+        worker.start()
+        worker.join(5)
+        assert len(done) == 2, "the orders were locked during the log rewrite"
+    finally:
+        release.set()
+        snapshot.join()
+        worker.join()
+
+    # The order created during the rewrite is still logged
+    name, bob = done
+    assert name == 'Alice'
+    storage.log.sync()
+    assert [record['id'] for record in server.AppendLog.read(storage.log_path)] == [bob]
+    assert stored_names(storage) == ['Alice']
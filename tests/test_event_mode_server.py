@@ -0,0 +1,58 @@
+"""Event mode started the way the Docker image starts the server: python server.py"""
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def event_server(tmp_path):
+    port = free_port()
+    env = dict(os.environ, KOS_STORAGE='event', KOS_PORT=str(port))
+    # The reloader of debug mode serves from a child process, stop both with their session
+    process = subprocess.Popen([sys.executable, SERVER], cwd=str(tmp_path), env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    yield f'http://127.0.0.1:{port}'
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout=10)
+
+
+def wait_ready(url, timeout=20):
+    """Get the /readyz answer once the server is ready, or the last one after `timeout` seconds"""
+    deadline = time.monotonic() + timeout
+    readiness = None
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + '/readyz') as response:
+                readiness = json.load(response)
+        except OSError as e:
+            # Not listening yet, or 503 until the warm-up is done
+            readiness = json.load(e) if hasattr(e, 'code') else None
+        if readiness and readiness['ready']:
+            break
+        time.sleep(0.1)
+    return readiness
+
+
+def test_event_mode_serves_under_the_reloader(event_server):
+    readiness = wait_ready(event_server)
+    assert readiness is not None and readiness['ready'], readiness
+    assert readiness['warm_up']['error'] is None
+
+    with urllib.request.urlopen(event_server + '/') as response:
+        assert response.status == 200
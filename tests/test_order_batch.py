@@ -0,0 +1,77 @@
+"""Orders sent in batches by the offline outbox, with malformed entries refused one by one"""
+
+import os
+
+import pytest
+
+import server
+
+ENGINES = ['sqlite', 'memory', 'event']
+
+ORDER = {'kebab_type': 'Galette', 'meat': 'Poulet', 'sauces': ['Blanche'], 'veggie_option': 'nature'}
+
+
+@pytest.fixture(params=ENGINES)
+def app(request, tmp_path):
+    app = server.create_app({
+        'STORAGE': request.param,
+        'DB_PATH': os.path.join(str(tmp_path), 'kos.db'),
+        'BACKUP_DIR': os.path.join(str(tmp_path), 'backups'),
+        'HISTORY_DIR': os.path.join(str(tmp_path), 'history'),
+        'WARM_UP': False,
+        'SCHEDULER': False,
+        'TESTING': True,
+    })
+    yield app
+    storage = app.extensions['kos'].storage
+    if hasattr(storage, 'close'):
+        storage.close()
+
+
+def place(app, orders):
+    response = app.test_client().post('/api/orders/batch', json={'orders': orders})
+    assert response.status_code == 200, response.data
+    return [(result['client_id'], result['status']) for result in response.get_json()['results']]
+
+
+def test_batch_creates_and_replays(app):
+    orders = [dict(ORDER, name='Alice', client_id='c-1'), dict(ORDER, client_id='c-2')]
+    assert place(app, orders) == [('c-1', 'created'), ('c-2', 'created')]
+    assert place(app, orders) == [('c-1', 'duplicate'), ('c-2', 'duplicate')]
+
+    with app.app_context():
+        names = sorted(order.name for order in server.get_storage().list_window(''))
+    assert names == ['Alice', 'Anonymous']
+
+
+def test_malformed_entries_are_invalid(app):
+    results = place(app, [
+        dict(ORDER, name=None, client_id='null-name'),
+        dict(ORDER, name={'first': 'Alice'}, client_id='dict-name'),
+        dict(ORDER, name=['Alice'], client_id='list-name'),
+        dict(ORDER, name='Alice', client_id=['c-1']),
+        dict(ORDER, name='Alice', client_id={'id': 1}),
+        dict(ORDER, name='Alice', client_id=7),
+        'not an order',
+        dict(ORDER, name='Bob', client_id='c-2'),
+    ])
+    assert results == [
+        ('null-name', 'invalid'),
+        ('dict-name', 'invalid'),
+        ('list-name', 'invalid'),
+        (['c-1'], 'invalid'),
+        ({'id': 1}, 'invalid'),
+        (7, 'invalid'),
+        (None, 'invalid'),
+        ('c-2', 'created'),
+    ]
+
+    # Only the valid order was stored, and the stored orders can still be searched and snapshotted
+    client = app.test_client()
+    response = client.get('/api/orders/search?q=galette')
+    assert response.status_code == 200
+    assert [order['name'] for order in response.get_json()['orders']] == ['Bob']
+
+    storage = app.extensions['kos'].storage
+    if hasattr(storage, 'snapshot'):
+        assert storage.snapshot() == 1
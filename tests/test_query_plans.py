@@ -0,0 +1,37 @@
+"""The hot queries of the SQLite storage read the tables through indexes"""
+
+import os
+
+import pytest
+
+import server
+from server import SQLiteOrderRepository
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteOrderRepository(os.path.join(str(tmp_path), 'kos.db'))
+
+
+@pytest.mark.parametrize('sql, params', SQLiteOrderRepository.HOT_QUERIES,
+                         ids=[server.statement_fingerprint(sql)[:60] for sql, _ in SQLiteOrderRepository.HOT_QUERIES])
+def test_hot_query_uses_indexes(storage, sql, params):
+    conn = storage.connect()
+    try:
+        server.assert_uses_index(conn, sql, params)
+    finally:
+        conn.close()
+
+
+def test_check_query_plans(storage):
+    assert len(storage.check_query_plans()) == len(SQLiteOrderRepository.HOT_QUERIES)
+
+
+def test_full_scan_is_reported(storage):
+    conn = storage.connect()
+    try:
+        conn.execute('DROP INDEX orders_timestamp')
+        with pytest.raises(AssertionError, match='Full scan'):
+            server.assert_uses_index(conn, SQLiteOrderRepository.WINDOW_SQL, ('',))
+    finally:
+        conn.close()
@@ -0,0 +1,270 @@
+"""Behaviour shared by every order storage engine, run against each of them"""
+
+import os
+
+import pytest
+
+import server
+from server import OrderSelection
+
+ENGINES = ['sqlite', 'memory', 'event']
+
+GALETTE = ('Galette', 'Poulet', ['Blanche'], False, ['Salade', 'Tomate'])
+SANDWICH = ('Sandwich', 'Boeuf', ['Piquante'], True, [])
+
+# Before every order of the tests
+MORNING = '2026-03-01 08:00:00'
+
+
+def at(minute):
+    """Get the timestamp of an order placed `minute` minutes after noon"""
+    return f'2026-03-01 12:{minute:02d}:00'
+
+
+class Engines:
+    """Opens the engines on a temporary directory and closes them after the test"""
+
+    def __init__(self, engine, directory):
+        self.engine = engine
+        self.db_path = os.path.join(directory, 'kos.db')
+        self.opened = []
+
+    def open(self):
+        if self.engine == 'sqlite':
+            storage = server.SQLiteOrderRepository(self.db_path)
+        elif self.engine == 'memory':
+            storage = server.InMemoryOrderRepository()
+        else:
+            storage = server.EventModeOrderRepository(self.db_path, self.db_path + '-log.jsonl',
+                                                      max_loss=0, snapshot_interval=3600)
+        self.opened.append(storage)
+        return storage
+
+    def reopen(self, storage):
+        """Close `storage` and open it again on the same files"""
+        self.close(storage)
+        return self.open()
+
+    @staticmethod
+    def close(storage):
+        if hasattr(storage, 'close'):
+            storage.close()
+
+    def close_all(self):
+        for storage in self.opened:
+            self.close(storage)
+
+
+@pytest.fixture(params=ENGINES)
+def engines(request, tmp_path):
+    engines = Engines(request.param, str(tmp_path))
+    yield engines
+    engines.close_all()
+
+
+@pytest.fixture
+def storage(engines):
+    return engines.open()
+
+
+def create(storage, name, config=GALETTE, minute=0, client_id=None):
+    return storage.create(name, *config, at(minute), client_id=client_id)
+
+
+def test_create_and_get(storage):
+    order_id = create(storage, 'Alice', client_id='c-1')
+
+    order = storage.get(order_id)
+    assert isinstance(order, server.Order)
+    assert order.id == order_id
+    assert order.name == 'Alice'
+    assert order.config == ('Galette', 'Poulet', ('Blanche',), False, ('Salade', 'Tomate'))
+    assert order.timestamp == at(0)
+    assert order.client_id == 'c-1'
+    assert order.version == 1
+    assert storage.get(order_id + 1000) is None
+
+
+def test_create_replays_client_id(storage):
+    order_id = create(storage, 'Alice', client_id='c-1')
+    assert create(storage, 'Alice again', client_id='c-1') == order_id
+    assert len(storage.list_window(MORNING)) == 1
+
+    results = storage.create_many([
+        {'name': 'Bob', 'kebab_type': 'Sandwich', 'meat': 'Boeuf', 'sauces': [], 'is_nature': True,
+         'vegetables': [], 'timestamp': at(1), 'client_id': 'c-2'},
+        {'name': 'Alice', 'kebab_type': 'Galette', 'meat': 'Poulet', 'sauces': [], 'is_nature': True,
+         'vegetables': [], 'timestamp': at(1), 'client_id': 'c-1'},
+    ])
+    assert results[1] == (order_id, False)
+    assert results[0][1] is True
+    assert storage.get(results[0][0]).name == 'Bob'
+
+
+def test_orders_share_ingredients(storage):
+    alice = storage.get(create(storage, 'Alice'))
+    bob = storage.get(create(storage, 'Bob'))
+
+    assert alice.sauces is bob.sauces
+    assert alice.vegetables is bob.vegetables
+
+
+def test_update_increments_version(storage):
+    order_id = create(storage, 'Alice')
+
+    assert storage.update(order_id, 'Alicia', *SANDWICH)
+    order = storage.get(order_id)
+    assert order.name == 'Alicia'
+    assert order.config == ('Sandwich', 'Boeuf', ('Piquante',), True, ())
+    assert order.timestamp == at(0)
+    assert order.version == 2
+
+    # Only applied at the expected version
+    assert not storage.update(order_id, 'Stale', *GALETTE, version=1)
+    assert storage.update(order_id, 'Fresh', *GALETTE, version=2)
+    assert storage.get(order_id).version == 3
+    assert not storage.update(order_id + 1000, 'Nobody', *GALETTE)
+
+
+def test_delete(storage):
+    order_id = create(storage, 'Alice')
+
+    assert storage.delete(order_id)
+    assert storage.get(order_id) is None
+    assert not storage.delete(order_id)
+
+
+def test_list_window(storage):
+    first = create(storage, 'Alice', minute=1)
+    second = create(storage, 'Bob', minute=2)
+    create(storage, 'Carol', minute=0)
+
+    assert [order.id for order in storage.list_window(at(0))] == [second, first]
+    assert storage.list_window(at(2)) == []
+
+
+def test_aggregate(storage):
+    create(storage, 'Alice', GALETTE, minute=1)
+    create(storage, 'Bob', SANDWICH, minute=2)
+    create(storage, 'Carol', GALETTE, minute=3)
+    create(storage, 'Dave', SANDWICH, minute=0)
+
+    galette = ('Galette', 'Poulet', ('Blanche',), False, ('Salade', 'Tomate'))
+    sandwich = ('Sandwich', 'Boeuf', ('Piquante',), True, ())
+    assert [(tuple(config), count) for config, count in storage.aggregate(at(0))] == [(galette, 2), (sandwich, 1)]
+
+
+def test_changes_since(storage):
+    start = storage.latest_seq()
+    order_id = create(storage, 'Alice', client_id='c-1')
+    storage.update(order_id, 'Alicia', *SANDWICH)
+    storage.delete(order_id)
+
+    events, latest, _ = storage.changes_since(start, 10)
+    assert [event['op'] for event in events] == ['create', 'update', 'delete']
+    assert [event['order_id'] for event in events] == [order_id] * 3
+    assert latest == events[-1]['seq'] == storage.latest_seq()
+    assert [event['seq'] for event in events] == sorted(event['seq'] for event in events)
+
+    created, updated, deleted = (event['order'] for event in events)
+    assert created.name == 'Alice' and created.client_id == 'c-1' and created.version == 1
+    assert updated.name == 'Alicia' and updated.client_id == 'c-1' and updated.version == 2
+    assert updated.config == ('Sandwich', 'Boeuf', ('Piquante',), True, ())
+    assert deleted is None
+
+    assert storage.changes_since(events[0]['seq'], 1)[0] == events[1:2]
+    assert storage.changes_since(latest, 10)[0] == []
+
+
+def test_change_counter(storage):
+    counter = storage.change_counter()
+    order_id = create(storage, 'Alice')
+    after_create = storage.change_counter()
+    assert after_create > counter
+
+    storage.update(order_id, 'Alicia', *GALETTE)
+    after_update = storage.change_counter()
+    assert after_update > after_create
+
+    storage.delete(order_id)
+    assert storage.change_counter() > after_update
+
+
+def test_bulk_delete(storage):
+    alice = create(storage, 'Alice', minute=1)
+    bob = create(storage, 'Bob', minute=2)
+    carol = create(storage, 'Carol', minute=3)
+
+    assert storage.bulk_delete(OrderSelection(ids=[alice, bob], until=at(1))) == 1
+    assert storage.get(alice) is None
+    assert storage.bulk_delete(OrderSelection(since=at(2), until=at(3))) == 2
+    assert storage.get(bob) is None and storage.get(carol) is None
+    assert storage.bulk_delete(OrderSelection(name='Nobody')) == 0
+
+
+def test_bulk_archive(storage):
+    alice = create(storage, 'Alice', minute=1)
+    bob = create(storage, 'Bob', minute=2)
+
+    assert storage.bulk_archive(OrderSelection(name='Alice')) == 1
+    assert storage.get(alice) is None
+    assert storage.get(bob) is not None
+    assert [order.id for order in storage.last_orders('Alice', 10)] == [alice]
+
+
+def test_bulk_duplicate(storage):
+    alice = create(storage, 'Alice', minute=1)
+    create(storage, 'Bob', SANDWICH, minute=2)
+    storage.bulk_archive(OrderSelection(ids=[alice]))
+
+    assert storage.bulk_duplicate(OrderSelection(ids=[alice]), at(10)) == 1
+    copies = storage.list_window(at(5))
+    assert [(order.name, order.config, order.timestamp) for order in copies] == [
+        ('Alice', ('Galette', 'Poulet', ('Blanche',), False, ('Salade', 'Tomate')), at(10))]
+    assert copies[0].id != alice
+
+
+def test_search(storage):
+    alice = create(storage, 'Alice Martin', GALETTE, minute=1)
+    bob = create(storage, 'Bob', SANDWICH, minute=2)
+    carol = create(storage, 'Carol', GALETTE, minute=3)
+    storage.bulk_archive(OrderSelection(ids=[alice]))
+
+    assert [order.id for order in storage.search('gal pou', 10)] == [carol, alice]
+    assert [order.id for order in storage.search('mart', 10)] == [alice]
+    assert [order.id for order in storage.search('boeuf piq', 10)] == [bob]
+    assert storage.search('gal boeuf', 10) == []
+    assert len(storage.search('salade', 1)) == 1
+
+
+def test_last_orders_and_reorder(storage):
+    first = create(storage, 'Alice', GALETTE, minute=1)
+    second = create(storage, 'Alice', SANDWICH, minute=2)
+    create(storage, 'Bob', GALETTE, minute=3)
+    storage.bulk_archive(OrderSelection(ids=[first]))
+
+    assert [order.id for order in storage.last_orders('Alice', 10)] == [second, first]
+    assert [order.id for order in storage.last_orders('Alice', 1)] == [second]
+
+    copy_id = storage.reorder(first, at(20))
+    copy = storage.get(copy_id)
+    assert copy.name == 'Alice'
+    assert copy.config == ('Galette', 'Poulet', ('Blanche',), False, ('Salade', 'Tomate'))
+    assert copy.timestamp == at(20)
+    assert storage.reorder(copy_id + 1000, at(20)) is None
+
+
+def test_orders_survive_reopening(engines, storage):
+    if engines.engine == 'memory':
+        pytest.skip('the memory engine keeps nothing')
+
+    alice = create(storage, 'Alice', client_id='c-1')
+    storage.update(alice, 'Alicia', *SANDWICH)
+    bob = create(storage, 'Bob', minute=1)
+    storage.delete(bob)
+
+    storage = engines.reopen(storage)
+    order = storage.get(alice)
+    assert (order.name, order.client_id, order.version) == ('Alicia', 'c-1', 2)
+    assert storage.get(bob) is None
+    assert create(storage, 'Carol', minute=2) not in (alice, bob)
@@ -0,0 +1,45 @@
+"""Warm-up of a new worker, retried until it succeeds"""
+
+import os
+import time
+
+import server
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_failed_warm_up_is_retried(tmp_path):
+    db_path = os.path.join(str(tmp_path), 'kos.db')
+    # Another instance holds the event log while the worker boots
+    holder = server.EventModeOrderRepository(db_path, db_path + '-log.jsonl', snapshot_interval=3600)
+
+    app = server.create_app({
+        'STORAGE': 'event',
+        'DB_PATH': db_path,
+        'SCHEDULER': False,
+        'WARM_UP_RETRY_DELAY': 0.01,
+        'WARM_UP_MAX_RETRY_DELAY': 0.05,
+    })
+    state = app.extensions['kos']
+    try:
+        wait_for(lambda: state.warm_up['attempts'] >= 3)
+        assert not state.ready
+        assert 'is locked' in state.warm_up['error']
+        response = app.test_client().get('/readyz')
+        assert response.status_code == 503
+
+        holder.close()
+        wait_for(lambda: state.ready)
+        assert app.test_client().get('/readyz').status_code == 200
+        # The last error stays reported
+        assert 'is locked' in state.warm_up['error']
+    finally:
+        holder.close()
+        wait_for(lambda: state.ready or state.warm_up['attempts'] > 100)
+        if state.storage is not None:
+            state.storage.close()